@@ -1,19 +1,41 @@
 from .simple_node_store import *
 from .base_node_store import *
 from .remote_node_store import *
-import random
+from .async_node_store import *
+from .mmap_node_store import *
+import os
 
-port = random.randint(10000, 64000)
-
-def get_node_store(name="simple", path="/tmp"):
-  global port
+def get_node_store(name="simple", path="/tmp", checksums=False, fsync=FSYNC_NONE):
   if name == "simple":
-    return SimpleNodeStore(path)
+    return SimpleNodeStore(path, checksums)
+  elif name == "mmap":
+    return MmapNodeStore(path, checksums, fsync)
   elif name == "remote":
-    server = RemoteNodeStoreServer("localhost", port, path)
+    # port 0 lets the OS pick a free port
+    server = RemoteNodeStoreServer("localhost", 0, path, checksums)
     server_thread = threading.Thread(target=server.Listen)
     server_thread.daemon = True
     server_thread.start()
-    client = RemoteNodeStoreClient("localhost", port)
-    port += 1
-    return client
\ No newline at end of file
+    return RemoteNodeStoreClient("localhost", server.port)
+
+class NodeMap(dict):
+  # node id -> node store, attached on first use from its descriptor
+  # ({'type': ..., 'path': ..., 'checksums': ..., 'fsync': ...}, relative paths are taken
+  # from root); nodes marked 'rebuilding' are attached as crashed
+  def __init__(self, descriptors, root=""):
+    super().__init__()
+    self.descriptors = descriptors
+    self.root = root
+
+  def __missing__(self, node_id):
+    descriptor = self.descriptors[node_id]
+    node = get_node_store(descriptor['type'], os.path.join(self.root, descriptor['path']), descriptor.get('checksums', False), descriptor.get('fsync', FSYNC_NONE))
+    if descriptor.get('rebuilding', False):
+      node.Crash()
+    self[node_id] = node
+    return node
+
+def get_async_node_store(node_store):
+  if isinstance(node_store, RemoteNodeStoreClient):
+    return AsyncRemoteNodeStoreClient(node_store)
+  return AsyncSimpleNodeStore(node_store)
@@ -0,0 +1,185 @@
+import asyncio
+
+from .simple_node_store import *
+from .remote_node_store import *
+
+class AsyncNodeStore:
+  # coroutine counterpart of BaseNodeStore; Alive/Crash/Recover stay
+  # synchronous since they only flip local state
+  async def Write(self, key, content):
+    pass
+
+  async def Append(self, key, content):
+    pass
+
+  async def WriteRange(self, key, offset, content):
+    pass
+
+  async def Read(self, key):
+    pass
+
+  async def ReadRange(self, key, offset, length):
+    return (await self.Read(key))[offset:offset + length]
+
+  async def ReadInto(self, key, buf, offset=0):
+    content = await self.ReadRange(key, offset, len(buf))
+    buf[:len(content)] = content
+    return len(content)
+
+  def Alive(self):
+    return True
+
+  def Crash(self):
+    pass
+
+  def Recover(self):
+    pass
+
+  async def Close(self):
+    pass
+
+class AsyncSimpleNodeStore(AsyncNodeStore):
+  # local files are served by the event loop's shared executor, so no
+  # thread is created per call
+  def __init__(self, node_store):
+    self.node_store = node_store
+
+  async def Write(self, key, content):
+    await asyncio.to_thread(self.node_store.Write, key, content)
+
+  async def Append(self, key, content):
+    await asyncio.to_thread(self.node_store.Append, key, content)
+
+  async def WriteRange(self, key, offset, content):
+    await asyncio.to_thread(self.node_store.WriteRange, key, offset, content)
+
+  async def Read(self, key):
+    return await asyncio.to_thread(self.node_store.Read, key)
+
+  async def ReadRange(self, key, offset, length):
+    return await asyncio.to_thread(self.node_store.ReadRange, key, offset, length)
+
+  async def ReadInto(self, key, buf, offset=0):
+    return await asyncio.to_thread(self.node_store.ReadInto, key, buf, offset)
+
+  def Alive(self):
+    return self.node_store.Alive()
+
+  def Crash(self):
+    self.node_store.Crash()
+
+  def Recover(self):
+    self.node_store.Recover()
+
+class AsyncConnection:
+  # asyncio version of Connection: requests are written without yielding in
+  # between, so responses can be collected in send order. A call cancelled
+  # or failed after its request went out would leave its response unread,
+  # so the connection is then broken like a Connection with a transport error
+  def __init__(self, reader, writer):
+    self.reader = reader
+    self.writer = writer
+    self.recv_cond = asyncio.Condition()
+    self.sent = 0
+    self.received = 0
+    self.broken = False
+
+  async def Call(self, action, key, offset=0, length=0, payload=None, buf=None):
+    if self.broken:
+      raise ConnectionError('connection is broken')
+    name = bytes(key, 'utf-8')
+    ticket = self.sent
+    self.sent += 1
+    self.writer.write(REQUEST.pack(action, len(name), offset, length) + name)
+    if payload is not None and length > 0:
+      self.writer.write(payload)
+
+    try:
+      await self.writer.drain()
+      async with self.recv_cond:
+        await self.recv_cond.wait_for(lambda: self.received == ticket or self.broken)
+        if self.broken:
+          raise ConnectionError('connection is broken')
+        try:
+          status, length = RESPONSE.unpack(await self.reader.readexactly(RESPONSE.size))
+          content = await self.reader.readexactly(length)
+        finally:
+          self.received += 1
+          self.recv_cond.notify_all()
+    except BaseException:
+      await self.__break()
+      raise
+    if status == STATUS_NOT_FOUND:
+      raise FileNotFoundError(key)
+    if status != STATUS_OK:
+      raise IOError(str(content, 'utf-8'))
+    if buf is not None:
+      buf[:length] = content
+      return length
+    return content
+
+  async def __break(self):
+    # fail the calls waiting for their turn, the client reconnects
+    self.broken = True
+    self.writer.close()
+    async with self.recv_cond:
+      self.recv_cond.notify_all()
+
+  async def Close(self):
+    self.writer.close()
+    await self.writer.wait_closed()
+
+class AsyncRemoteNodeStoreClient(AsyncNodeStore):
+  # talks the RemoteNodeStoreServer protocol over one pipelined connection
+  # per event loop
+  def __init__(self, node_store):
+    self.node_store = node_store
+    self.conn = None
+    self.loop = None
+
+  async def __conn(self):
+    loop = asyncio.get_running_loop()
+    if self.conn is None or self.conn.broken or self.loop is not loop:
+      reader, writer = await asyncio.open_connection(self.node_store.remote_host, self.node_store.remote_port)
+      if self.conn is None or self.conn.broken or self.loop is not loop:
+        self.conn = AsyncConnection(reader, writer)
+        self.loop = loop
+      else:
+        # another coroutine connected first
+        writer.close()
+    return self.conn
+
+  async def Write(self, key, content):
+    content = memoryview(content).cast('B')
+    await (await self.__conn()).Call(ACTION_WRITE, key, length=len(content), payload=content)
+
+  async def Append(self, key, content):
+    content = memoryview(content).cast('B')
+    await (await self.__conn()).Call(ACTION_APPEND, key, length=len(content), payload=content)
+
+  async def WriteRange(self, key, offset, content):
+    content = memoryview(content).cast('B')
+    await (await self.__conn()).Call(ACTION_WRITE_RANGE, key, offset, len(content), content)
+
+  async def Read(self, key):
+    return await (await self.__conn()).Call(ACTION_READ, key)
+
+  async def ReadRange(self, key, offset, length):
+    return await (await self.__conn()).Call(ACTION_READ_RANGE, key, offset, length)
+
+  async def ReadInto(self, key, buf, offset=0):
+    return await (await self.__conn()).Call(ACTION_READ_RANGE, key, offset, len(buf), buf=buf)
+
+  def Alive(self):
+    return self.node_store.Alive()
+
+  def Crash(self):
+    self.node_store.Crash()
+
+  def Recover(self):
+    self.node_store.Recover()
+
+  async def Close(self):
+    if self.conn is not None:
+      await self.conn.Close()
+      self.conn = None
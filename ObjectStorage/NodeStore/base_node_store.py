@@ -1,13 +1,46 @@
+import zlib
+import numpy as np
+
+# bytes covered by one shard checksum
+CHECKSUM_BLOCK = 4096
+
+def block_checksums(content):
+  # CRC32 of every CHECKSUM_BLOCK bytes of content, the last block may be short
+  content = memoryview(content).cast('B')
+  sums = [zlib.crc32(content[i:i + CHECKSUM_BLOCK]) for i in range(0, len(content), CHECKSUM_BLOCK)]
+  return np.array(sums, dtype='<u4')
+
 class BaseNodeStore:
   def Start(self):
     pass
 
   def Write(self, key, content):
     pass
+
+  def Append(self, key, content):
+    pass
+
+  def WriteRange(self, key, offset, content):
+    data = bytearray(self.Read(key))
+    data[offset:offset + len(content)] = content
+    self.Write(key, data)
   
   def Read(self, key):
     pass
+
+  def ReadRange(self, key, offset, length):
+    return self.Read(key)[offset:offset + length]
+
+  def ReadInto(self, key, buf, offset=0):
+    content = self.ReadRange(key, offset, len(buf))
+    buf[:len(content)] = content
+    return len(content)
   
+  def Checksums(self, key, first=0, count=None):
+    # stored checksums of blocks [first, first + count), None if the node
+    # does not keep them
+    return None
+
   def Alive(self):
     return True
   
@@ -0,0 +1,280 @@
+import mmap
+import os
+import resource
+import sys
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+
+from .base_node_store import block_checksums
+from .simple_node_store import SimpleNodeStore
+
+FSYNC_NONE = "none"
+FSYNC_ALWAYS = "always"
+FSYNC_GROUP = "group"
+# seconds a group commit waits to collect more writes
+GROUP_INTERVAL = 0.005
+# shards kept mapped by all mmap nodes of the process together
+MAP_CACHE_SIZE = 1024
+# mappings hold a duplicate of their file's descriptor unless made with
+# trackfd=False
+TRACKFD = sys.version_info >= (3, 13)
+
+def fsync_file(path):
+  fd = os.open(path, os.O_RDONLY)
+  try:
+    os.fsync(fd)
+  finally:
+    os.close(fd)
+
+def map_cache_size():
+  # without trackfd every mapping holds a descriptor, so mappings get at
+  # most a quarter of the descriptor limit
+  if TRACKFD:
+    return MAP_CACHE_SIZE
+  soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+  if soft == resource.RLIM_INFINITY:
+    return MAP_CACHE_SIZE
+  return max(1, min(MAP_CACHE_SIZE, soft // 4))
+
+def map_file(fd, size):
+  if TRACKFD:
+    return mmap.mmap(fd, size, access=mmap.ACCESS_READ, trackfd=False)
+  return mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+
+def close_map(mapping):
+  # a mapping with views still in use is left open, it is closed when the
+  # last view is gone
+  try:
+    mapping.close()
+  except BufferError:
+    pass
+
+class MapCache:
+  # read-only mappings of the shards of every MmapNodeStore, keyed by (node
+  # path, key) and evicted least recently used first. Views are created
+  # under the lock, so an evicted mapping is either closed before anyone
+  # sees it or kept open by the views handed out
+  def __init__(self, size):
+    self.size = size
+    self.maps = OrderedDict()
+    self.lock = threading.Lock()
+
+  def View(self, entry):
+    with self.lock:
+      if entry not in self.maps:
+        return None
+      self.maps.move_to_end(entry)
+      return memoryview(self.maps[entry])
+
+  def Add(self, entry, mapping):
+    with self.lock:
+      if entry in self.maps:
+        # another reader mapped the shard first
+        close_map(mapping)
+        self.maps.move_to_end(entry)
+        return memoryview(self.maps[entry])
+      self.maps[entry] = mapping
+      view = memoryview(mapping)
+      while len(self.maps) > self.size:
+        close_map(self.maps.popitem(last=False)[1])
+      return view
+
+  def Forget(self, entry):
+    with self.lock:
+      mapping = self.maps.pop(entry, None)
+      if mapping is not None:
+        close_map(mapping)
+
+  def Drop(self, path):
+    # forget every mapping of the node at path
+    with self.lock:
+      for entry in [entry for entry in self.maps if entry[0] == path]:
+        close_map(self.maps.pop(entry))
+
+MAPS = MapCache(map_cache_size())
+
+def pwrite_all(fd, content, offset):
+  content = memoryview(content).cast('B')
+  while len(content) > 0:
+    n = os.pwrite(fd, content, offset)
+    content = content[n:]
+    offset += n
+
+class MmapNodeStore(SimpleNodeStore):
+  # same on-disk layout as SimpleNodeStore, so the two are interchangeable.
+  # Reads are served from a read-only mmap of every shard, cached in MAPS;
+  # ReadRange returns a view of it without copying, which stays valid after
+  # the shard is rewritten and shows later WriteRange/Append updates. Writes use pwrite
+  # on preallocated files, whole shards go to a temporary file that replaces
+  # the old one. fsync is FSYNC_NONE (leave it to the OS), FSYNC_ALWAYS
+  # (before every write returns) or FSYNC_GROUP (writers wait for one fsync
+  # of every file written in the last GROUP_INTERVAL); checksum files are
+  # synced along with their shards
+  def __init__(self, path="", checksums=False, fsync=FSYNC_NONE):
+    super().__init__(path, checksums)
+    if fsync not in (FSYNC_NONE, FSYNC_ALWAYS, FSYNC_GROUP):
+      raise ValueError(f"unknown fsync policy {fsync}")
+    self.fsync = fsync
+    # group commit: paths waiting for the next fsync, the number of that
+    # group and of the last group synced
+    self.pending = set()
+    self.next_group = 1
+    self.synced = 0
+    self.group_cond = threading.Condition()
+    self.flusher = None
+    self.closed = False
+
+  def Write(self, key, content):
+    obj_path = os.path.join(self.path, f"{key}.obj")
+    tmp_path = obj_path + ".tmp"
+    content = memoryview(content).cast('B')
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+      if len(content) > 0:
+        os.posix_fallocate(fd, 0, len(content))
+      pwrite_all(fd, content, 0)
+      if self.fsync == FSYNC_ALWAYS:
+        os.fsync(fd)
+    finally:
+      os.close(fd)
+    os.replace(tmp_path, obj_path)
+    self.__forget(key)
+    if self.checksums:
+      with open(self.__crc_path(key), 'wb') as f:
+        f.write(block_checksums(content))
+      if self.fsync == FSYNC_ALWAYS:
+        fsync_file(self.__crc_path(key))
+    self.__sync(key, True)
+
+  def Append(self, key, content):
+    obj_path = os.path.join(self.path, f"{key}.obj")
+    content = memoryview(content).cast('B')
+    fd = os.open(obj_path, os.O_WRONLY | os.O_CREAT, 0o644)
+    try:
+      offset = os.fstat(fd).st_size
+      if len(content) > 0:
+        os.posix_fallocate(fd, offset, len(content))
+      pwrite_all(fd, content, offset)
+      if self.fsync == FSYNC_ALWAYS:
+        os.fsync(fd)
+    finally:
+      os.close(fd)
+    self.__forget(key)
+    if self.checksums:
+      self.UpdateChecksums(key, offset, offset + len(content))
+    self.__sync(key, offset == 0)
+
+  def WriteRange(self, key, offset, content):
+    obj_path = os.path.join(self.path, f"{key}.obj")
+    content = memoryview(content).cast('B')
+    fd = os.open(obj_path, os.O_WRONLY)
+    try:
+      grows = offset + len(content) > os.fstat(fd).st_size
+      pwrite_all(fd, content, offset)
+      if self.fsync == FSYNC_ALWAYS:
+        os.fsync(fd)
+    finally:
+      os.close(fd)
+    if grows:
+      self.__forget(key)
+    if self.checksums:
+      self.UpdateChecksums(key, offset, offset + len(content))
+    self.__sync(key, False)
+
+  def UpdateChecksums(self, key, start, end):
+    super().UpdateChecksums(key, start, end)
+    if self.fsync == FSYNC_ALWAYS:
+      fsync_file(self.__crc_path(key))
+
+  def Read(self, key):
+    return bytes(self.__map(key))
+
+  def ReadRange(self, key, offset, length):
+    return self.__map(key)[offset:offset + length]
+
+  def ReadInto(self, key, buf, offset=0):
+    content = self.__map(key)[offset:offset + len(buf)]
+    buf[:len(content)] = content
+    return len(content)
+
+  def Corrupt(self, key):
+    # shuffle the shard behind the checksums' back, like bit rot would
+    content = np.frombuffer(self.Read(key), dtype=np.uint8).copy()
+    np.random.shuffle(content)
+    obj_path = os.path.join(self.path, f"{key}.obj")
+    with open(obj_path + ".tmp", 'wb') as f:
+      f.write(content)
+    os.replace(obj_path + ".tmp", obj_path)
+    self.__forget(key)
+
+  def Close(self):
+    with self.group_cond:
+      self.closed = True
+      self.group_cond.notify_all()
+    if self.flusher is not None:
+      self.flusher.join()
+      self.flusher = None
+    MAPS.Drop(self.path)
+
+  def __map(self, key):
+    # memoryview of the whole shard, mapped once and reused until the shard
+    # is replaced or grows
+    view = MAPS.View((self.path, key))
+    if view is not None:
+      return view
+    with open(os.path.join(self.path, f"{key}.obj"), 'rb') as f:
+      size = os.fstat(f.fileno()).st_size
+      if size == 0:
+        return memoryview(b'')
+      mapping = map_file(f.fileno(), size)
+    return MAPS.Add((self.path, key), mapping)
+
+  def __forget(self, key):
+    MAPS.Forget((self.path, key))
+
+  def __crc_path(self, key):
+    return os.path.join(self.path, f"{key}.crc")
+
+  def __sync(self, key, new_file):
+    # a new or replaced file also needs its directory entry synced
+    if self.fsync == FSYNC_ALWAYS:
+      if new_file:
+        self.__sync_dir()
+    elif self.fsync == FSYNC_GROUP:
+      with self.group_cond:
+        if self.flusher is None:
+          self.flusher = threading.Thread(target=self.__flush, daemon=True)
+          self.flusher.start()
+        self.pending.add(os.path.join(self.path, f"{key}.obj"))
+        if self.checksums:
+          self.pending.add(self.__crc_path(key))
+        group = self.next_group
+        self.group_cond.notify_all()
+        self.group_cond.wait_for(lambda: self.synced >= group)
+
+  def __sync_dir(self):
+    fsync_file(self.path)
+
+  def __flush(self):
+    while True:
+      with self.group_cond:
+        self.group_cond.wait_for(lambda: len(self.pending) > 0 or self.closed)
+        if self.closed and len(self.pending) == 0:
+          return
+      # let more writers join this group
+      time.sleep(GROUP_INTERVAL)
+      with self.group_cond:
+        paths, self.pending = self.pending, set()
+        group = self.next_group
+        self.next_group += 1
+      for path in paths:
+        try:
+          fsync_file(path)
+        except FileNotFoundError:
+          continue
+      self.__sync_dir()
+      with self.group_cond:
+        self.synced = group
+        self.group_cond.notify_all()
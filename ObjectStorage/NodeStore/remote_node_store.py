@@ -1,84 +1,293 @@
 import socketserver
 import threading
 import socket
-import json
+import struct
+import itertools
+import queue
+import numpy as np
 
 from .base_node_store import *
 from .simple_node_store import *
 
-def recv_all(sock):
-  buff = b''
-  while True:
-    data = sock.recv(4096)
-    buff += data
-    if len(data) < 4096:
-      break
+# request: action, key length, offset, payload/read length; then key, payload
+REQUEST = struct.Struct('!BHQQ')
+# response: status, payload length; then payload
+RESPONSE = struct.Struct('!BQ')
+
+ACTION_WRITE = 1
+ACTION_APPEND = 2
+ACTION_READ = 3
+ACTION_READ_RANGE = 4
+ACTION_CORRUPT = 5
+ACTION_SHUTDOWN = 6
+ACTION_WRITE_RANGE = 7
+ACTION_CHECKSUMS = 8
+
+STATUS_OK = 0
+STATUS_NOT_FOUND = 1
+STATUS_ERROR = 2
+
+POOL_SIZE = 4
+
+def recv_into_all(sock, view):
+  view = memoryview(view).cast('B')
+  while len(view) > 0:
+    n = sock.recv_into(view)
+    if n == 0:
+      raise ConnectionError('connection closed by peer')
+    view = view[n:]
+
+def recv_all(sock, size):
+  buff = bytearray(size)
+  recv_into_all(sock, buff)
   return buff
 
+def send_all(sock, *buffers):
+  # send the buffers in as few segments as possible, header and payload of
+  # a message go out together instead of waiting on Nagle's algorithm
+  buffers = [memoryview(buf).cast('B') for buf in buffers if len(buf) > 0]
+  while len(buffers) > 0:
+    n = sock.sendmsg(buffers)
+    while n > 0 and n >= len(buffers[0]):
+      n -= len(buffers[0])
+      buffers.pop(0)
+    if n > 0:
+      buffers[0] = buffers[0][n:]
+
 def GetHandler(node_store):
   class RemoteNodeStoreHandler(socketserver.BaseRequestHandler):
+    def setup(self):
+      self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
     def handle(self):
-      data = recv_all(self.request)
-      if len(data) <= 0:
-        return
-      data = str(data, 'utf-8')
-      data = json.loads(data)
-      if data['action'] == 'write':
-        node_store.Write(data['key'], bytes(data['value']))
-        self.request.sendall(bytes('ok', 'utf-8'))
-      elif data['action'] == 'read':
-        data = node_store.Read(data['key'])
-        if data is not None:
-          self.request.sendall(data)
-      elif data['action'] == 'shutdown':
-        self.server.shutdown()
+      # requests on one connection are served in order, so clients can
+      # pipeline them and match responses first in, first out
+      while True:
+        try:
+          action, key_len, offset, length = REQUEST.unpack(recv_all(self.request, REQUEST.size))
+        except ConnectionError:
+          return
+        key = str(recv_all(self.request, key_len), 'utf-8')
+        if action in (ACTION_WRITE, ACTION_APPEND, ACTION_WRITE_RANGE):
+          value = recv_all(self.request, length)
+        try:
+          if action == ACTION_WRITE:
+            node_store.Write(key, memoryview(value))
+            self.respond(STATUS_OK)
+          elif action == ACTION_APPEND:
+            node_store.Append(key, memoryview(value))
+            self.respond(STATUS_OK)
+          elif action == ACTION_WRITE_RANGE:
+            node_store.WriteRange(key, offset, memoryview(value))
+            self.respond(STATUS_OK)
+          elif action == ACTION_READ:
+            self.respond(STATUS_OK, node_store.Read(key))
+          elif action == ACTION_READ_RANGE:
+            self.respond(STATUS_OK, node_store.ReadRange(key, offset, length))
+          elif action == ACTION_CHECKSUMS:
+            # offset is the first block, length the block count (0 for all)
+            checksums = node_store.Checksums(key, offset, length or None)
+            if checksums is None:
+              self.respond(STATUS_NOT_FOUND)
+            else:
+              self.respond(STATUS_OK, checksums.tobytes())
+          elif action == ACTION_CORRUPT:
+            node_store.Corrupt(key)
+            self.respond(STATUS_OK)
+          elif action == ACTION_SHUTDOWN:
+            self.respond(STATUS_OK)
+            self.server.shutdown()
+            return
+        except FileNotFoundError:
+          self.respond(STATUS_NOT_FOUND)
+        except Exception as e:
+          self.respond(STATUS_ERROR, bytes(str(e), 'utf-8'))
+
+    def respond(self, status, payload=b''):
+      send_all(self.request, RESPONSE.pack(status, len(payload)), payload)
 
   return RemoteNodeStoreHandler
 
+class ThreadingServer(socketserver.ThreadingTCPServer):
+  allow_reuse_address = True
+  daemon_threads = True
+
 class RemoteNodeStoreServer(BaseNodeStore):
-  def __init__(self, host, port, path):
+  def __init__(self, host, port, path, checksums=False):
     self.host = host
     self.port = port
-    self.node_store = SimpleNodeStore(path)
-    self.server = socketserver.TCPServer((self.host, self.port), GetHandler(self.node_store))
+    self.node_store = SimpleNodeStore(path, checksums)
+    self.server = ThreadingServer((self.host, self.port), GetHandler(self.node_store))
+    # the port actually bound, if 0 was asked for
+    self.port = self.server.server_address[1]
 
   def Listen(self):
     self.server.serve_forever()
+    self.server.server_close()
 
-class RemoteNodeStoreClient(BaseNodeStore):
+class Connection:
+  # one persistent socket; callers may have several requests in flight and
+  # collect the responses in the order the requests were sent. A transport
+  # error leaves the stream mid-frame, so the connection is then broken:
+  # it is closed and every pending and later request fails
   def __init__(self, host, port):
+    self.sock = socket.create_connection((host, port))
+    self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    self.send_lock = threading.Lock()
+    self.recv_cond = threading.Condition()
+    self.sent = 0
+    self.received = 0
+    self.broken = False
+
+  def Send(self, action, key, offset=0, length=0, payload=None):
+    key = bytes(key, 'utf-8')
+    with self.send_lock:
+      if self.broken:
+        raise ConnectionError('connection is broken')
+      ticket = self.sent
+      self.sent += 1
+      header = REQUEST.pack(action, len(key), offset, length) + key
+      try:
+        if payload is not None and length > 0:
+          send_all(self.sock, header, payload)
+        else:
+          send_all(self.sock, header)
+      except OSError:
+        self.__break()
+        raise
+    return ticket
+
+  def Receive(self, ticket, key, buf=None):
+    with self.recv_cond:
+      while self.received != ticket and not self.broken:
+        self.recv_cond.wait()
+      if self.broken:
+        raise ConnectionError('connection is broken')
+      try:
+        status, length = RESPONSE.unpack(recv_all(self.sock, RESPONSE.size))
+        if status == STATUS_OK and buf is not None:
+          recv_into_all(self.sock, memoryview(buf)[:length])
+          content = length
+        else:
+          content = recv_all(self.sock, length)
+      except OSError:
+        self.__break()
+        raise
+      finally:
+        self.received += 1
+        self.recv_cond.notify_all()
+    if status == STATUS_NOT_FOUND:
+      raise FileNotFoundError(key)
+    if status != STATUS_OK:
+      raise IOError(str(content, 'utf-8'))
+    return content
+
+  def Call(self, action, key, offset=0, length=0, payload=None, buf=None):
+    return self.Receive(self.Send(action, key, offset, length, payload), key, buf)
+
+  def __break(self):
+    with self.recv_cond:
+      self.broken = True
+      self.sock.close()
+      self.recv_cond.notify_all()
+
+  def Close(self):
+    self.sock.close()
+
+class RemoteNodeStoreClient(BaseNodeStore):
+  def __init__(self, host, port, pool_size=POOL_SIZE):
     self.remote_port = port
     self.remote_host = host
-  
+    self.alive = True
+    self.pool_size = pool_size
+    self.pool = []
+    self.pool_lock = threading.Lock()
+    self.next_conn = itertools.count()
+
+  def __conn(self):
+    # connections are opened on demand and reused round robin; broken ones
+    # are dropped and replaced
+    with self.pool_lock:
+      self.pool = [conn for conn in self.pool if not conn.broken]
+      if len(self.pool) < self.pool_size:
+        self.pool.append(Connection(self.remote_host, self.remote_port))
+        return self.pool[-1]
+      return self.pool[next(self.next_conn) % self.pool_size]
+
   def Read(self, key):
-    data = {
-      'action': 'read',
-      'key': key
-    }
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-      sock.connect((self.remote_host, self.remote_port))
-      sock.sendall(bytes(json.dumps(data), 'utf-8'))
-      data = bytes(recv_all(sock))
-      return data
-  
+    return bytes(self.__conn().Call(ACTION_READ, key))
+
+  def ReadRange(self, key, offset, length):
+    return bytes(self.__conn().Call(ACTION_READ_RANGE, key, offset, length))
+
+  def ReadInto(self, key, buf, offset=0):
+    return self.__conn().Call(ACTION_READ_RANGE, key, offset, len(buf), buf=buf)
+
   def Write(self, key, value):
-    data = {
-      'action': 'write',
-      'key': key,
-      'value': list(value),
-    }
-    str_data = json.dumps(data)
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-      sock.connect((self.remote_host, self.remote_port))
-      sock.sendall(bytes(str_data, 'utf-8'))
-  
+    value = memoryview(value).cast('B')
+    self.__conn().Call(ACTION_WRITE, key, length=len(value), payload=value)
+
+  def Append(self, key, value):
+    value = memoryview(value).cast('B')
+    self.__conn().Call(ACTION_APPEND, key, length=len(value), payload=value)
+
+  def WriteRange(self, key, offset, value):
+    value = memoryview(value).cast('B')
+    self.__conn().Call(ACTION_WRITE_RANGE, key, offset, len(value), value)
+
+  def Checksums(self, key, first=0, count=None):
+    try:
+      content = self.__conn().Call(ACTION_CHECKSUMS, key, first, count or 0)
+    except FileNotFoundError:
+      return None
+    return np.frombuffer(content, dtype='<u4')
+
+  def Pipeline(self, requests):
+    # send every (action, key, offset, length, payload) request on one
+    # connection without waiting for responses. Responses are drained by a
+    # reader thread meanwhile, otherwise a large response and a large
+    # request can fill both socket buffers and block client and server in
+    # sendall. Raises the first error after all responses are in
+    conn = self.__conn()
+    tickets = queue.Queue()
+    results = [None] * len(requests)
+    def receive():
+      for i in range(len(requests)):
+        ticket = tickets.get()
+        if ticket is None:
+          return
+        try:
+          results[i] = conn.Receive(ticket, requests[i][1])
+        except Exception as e:
+          results[i] = e
+    reader = threading.Thread(target=receive, daemon=True)
+    reader.start()
+    try:
+      for request in requests:
+        tickets.put(conn.Send(*request))
+    finally:
+      tickets.put(None)
+      reader.join()
+    for result in results:
+      if isinstance(result, Exception):
+        raise result
+    return results
+
+  def Alive(self):
+    return self.alive
+
+  def Crash(self):
+    self.alive = False
+
+  def Recover(self):
+    self.alive = True
+
+  def Corrupt(self, key):
+    self.__conn().Call(ACTION_CORRUPT, key)
+
   def Close(self):
-    data = {
-      'action': 'shutdown'
-    }
-    str_data = json.dumps(data)
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-      sock.connect((self.remote_host, self.remote_port))
-      sock.sendall(bytes(str_data, 'utf-8'))
-
-    
\ No newline at end of file
+    self.__conn().Call(ACTION_SHUTDOWN, '')
+    with self.pool_lock:
+      for conn in self.pool:
+        conn.Close()
+      self.pool = []
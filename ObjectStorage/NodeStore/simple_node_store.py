@@ -1,26 +1,79 @@
 import os
 import numpy as np
 
-from .base_node_store import BaseNodeStore
+from .base_node_store import BaseNodeStore, CHECKSUM_BLOCK, block_checksums
 
 class SimpleNodeStore(BaseNodeStore):
-  def __init__(self, path=""):
+  def __init__(self, path="", checksums=False):
     super().__init__()
     self.path = path
     self.alive = True
-    if not os.path.exists(self.path):
-      os.system('mkdir ' + self.path)
+    # keep a {key}.crc file of per-block checksums next to every shard
+    self.checksums = checksums
+    os.makedirs(self.path, exist_ok=True)
 
   def Write(self, key, content):
     obj_path = os.path.join(self.path, f"{key}.obj")
     with open(obj_path, 'wb+') as f:
       f.write(content)
+    if self.checksums:
+      with open(os.path.join(self.path, f"{key}.crc"), 'wb') as f:
+        f.write(block_checksums(content))
+
+  def Append(self, key, content):
+    obj_path = os.path.join(self.path, f"{key}.obj")
+    with open(obj_path, 'ab') as f:
+      offset = f.tell()
+      f.write(content)
+    if self.checksums:
+      self.UpdateChecksums(key, offset, offset + len(memoryview(content).cast('B')))
+
+  def WriteRange(self, key, offset, content):
+    obj_path = os.path.join(self.path, f"{key}.obj")
+    with open(obj_path, 'r+b') as f:
+      f.seek(offset)
+      f.write(content)
+    if self.checksums:
+      self.UpdateChecksums(key, offset, offset + len(memoryview(content).cast('B')))
+
+  def UpdateChecksums(self, key, start, end):
+    # recompute the stored checksums of the blocks overlapping [start, end)
+    first = start // CHECKSUM_BLOCK
+    last = -(-end // CHECKSUM_BLOCK)
+    content = self.ReadRange(key, first * CHECKSUM_BLOCK, (last - first) * CHECKSUM_BLOCK)
+    crc_path = os.path.join(self.path, f"{key}.crc")
+    with open(crc_path, 'r+b' if os.path.exists(crc_path) else 'wb') as f:
+      f.seek(first * 4)
+      f.write(block_checksums(content))
+
+  def Checksums(self, key, first=0, count=None):
+    if not self.checksums:
+      return None
+    try:
+      with open(os.path.join(self.path, f"{key}.crc"), 'rb') as f:
+        f.seek(first * 4)
+        content = f.read() if count is None else f.read(count * 4)
+    except FileNotFoundError:
+      return None
+    return np.frombuffer(content, dtype='<u4')
   
   def Read(self, key):
     obj_path = os.path.join(self.path, f"{key}.obj")
     with open(obj_path, 'rb') as f:
       content = f.read()
     return content
+
+  def ReadRange(self, key, offset, length):
+    obj_path = os.path.join(self.path, f"{key}.obj")
+    with open(obj_path, 'rb') as f:
+      f.seek(offset)
+      return f.read(length)
+
+  def ReadInto(self, key, buf, offset=0):
+    obj_path = os.path.join(self.path, f"{key}.obj")
+    with open(obj_path, 'rb') as f:
+      f.seek(offset)
+      return f.readinto(buf)
   
   def Alive(self):
     return self.alive
@@ -33,9 +86,8 @@ class SimpleNodeStore(BaseNodeStore):
     
   def Corrupt(self, key):
     obj_path = os.path.join(self.path, f"{key}.obj")
-    b = b''
     with open(obj_path, 'rb') as f:
-      b = list(f.read())
+      b = np.frombuffer(f.read(), dtype=np.uint8).copy()
     with open(obj_path, 'wb') as f:
       np.random.shuffle(b)
-      f.write(bytes(b))
\ No newline at end of file
+      f.write(b)
\ No newline at end of file
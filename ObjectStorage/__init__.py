@@ -1,4 +1,8 @@
 from .NodeStore.simple_node_store import *
 from .object_store import *
 from .parity import *
-from .multithreading import *
\ No newline at end of file
+from .meta_index import *
+from .read_cache import *
+from .stats import *
+from .multithreading import *
+from .scrubber import *
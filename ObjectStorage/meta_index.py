@@ -0,0 +1,147 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+CACHE_SIZE = 4096
+SCAN_BATCH = 1024
+
+
+class MetaIndex(MutableMapping):
+  # key -> metadata dict backed by SQLite: one row per key, committed and
+  # fsynced on every assignment, Set and Import, so lookups are O(log n),
+  # startup reads nothing and a returned write survives a power loss.
+  # Recently used entries stay in a bounded LRU. Only assignment is
+  # durable: an entry changed in place is written back when it leaves the
+  # LRU or on Flush/Close, and is lost on a crash before that, so update
+  # entries as index[key] = value like ObjectStore does.
+  def __init__(self, path, cache_size=CACHE_SIZE):
+    self.lock = threading.RLock()
+    self.cache = OrderedDict()
+    self.cache_size = cache_size
+    self.db = sqlite3.connect(path, check_same_thread=False)
+    self.db.execute('PRAGMA journal_mode=WAL')
+    # NORMAL skips the fsync of WAL commits, FULL syncs every commit
+    self.db.execute('PRAGMA synchronous=FULL')
+    self.db.execute('CREATE TABLE IF NOT EXISTS keys (key TEXT PRIMARY KEY, meta TEXT NOT NULL, error TEXT NOT NULL)')
+    self.db.execute('CREATE INDEX IF NOT EXISTS keys_error ON keys (error)')
+    self.db.execute('CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+    self.db.commit()
+
+  def __getitem__(self, key):
+    with self.lock:
+      if key in self.cache:
+        self.cache.move_to_end(key)
+        return self.cache[key][0]
+      row = self.db.execute('SELECT meta FROM keys WHERE key = ?', (key,)).fetchone()
+      if row is None:
+        raise KeyError(key)
+      value = json.loads(row[0])
+      self.__cache(key, value, row[0])
+      return value
+
+  def __setitem__(self, key, value):
+    with self.lock:
+      text = self.__store(key, value)
+      self.db.commit()
+      self.__cache(key, value, text)
+
+  def __delitem__(self, key):
+    with self.lock:
+      self.cache.pop(key, None)
+      cursor = self.db.execute('DELETE FROM keys WHERE key = ?', (key,))
+      self.db.commit()
+      if cursor.rowcount == 0:
+        raise KeyError(key)
+
+  def __contains__(self, key):
+    with self.lock:
+      if key in self.cache:
+        return True
+      return self.db.execute('SELECT 1 FROM keys WHERE key = ?', (key,)).fetchone() is not None
+
+  def __iter__(self):
+    return self.Scan()
+
+  def Scan(self, after=None):
+    # keys greater than after, in key order; read one batch at a time, so
+    # callers may update entries while iterating
+    last = after
+    while True:
+      with self.lock:
+        rows = self.db.execute('SELECT key FROM keys WHERE ? IS NULL OR key > ? ORDER BY key LIMIT ?', (last, last, SCAN_BATCH)).fetchall()
+      if len(rows) == 0:
+        return
+      for row in rows:
+        yield row[0]
+      last = rows[-1][0]
+
+  def __len__(self):
+    with self.lock:
+      return self.db.execute('SELECT COUNT(*) FROM keys').fetchone()[0]
+
+  def Errors(self):
+    # keys whose 'error' flag is set, found through the error index
+    with self.lock:
+      self.Flush()
+      rows = self.db.execute("SELECT key FROM keys WHERE error != 'No'").fetchall()
+    return [row[0] for row in rows]
+
+  def Get(self, name, default=None):
+    with self.lock:
+      row = self.db.execute('SELECT value FROM settings WHERE name = ?', (name,)).fetchone()
+    if row is None:
+      return default
+    return json.loads(row[0])
+
+  def Set(self, name, value):
+    with self.lock:
+      self.db.execute('INSERT OR REPLACE INTO settings (name, value) VALUES (?, ?)', (name, json.dumps(value)))
+      self.db.commit()
+
+  def Next(self, name):
+    # take the next value of a counter setting, starting at 0; concurrent
+    # callers get distinct values
+    with self.lock:
+      value = self.Get(name, 0)
+      self.Set(name, value + 1)
+    return value
+
+  def Import(self, keys):
+    # bulk load a key -> metadata dict in one transaction
+    with self.lock:
+      for key, value in keys.items():
+        self.cache.pop(key, None)
+        self.__store(key, value)
+      self.db.commit()
+
+  def Flush(self):
+    with self.lock:
+      for key, (value, text) in list(self.cache.items()):
+        self.__write_back(key, value, text)
+      self.db.commit()
+
+  def Close(self):
+    with self.lock:
+      self.Flush()
+      self.cache = OrderedDict()
+      self.db.close()
+
+  def __store(self, key, value):
+    text = json.dumps(value)
+    self.db.execute('INSERT OR REPLACE INTO keys (key, meta, error) VALUES (?, ?, ?)', (key, text, value.get('error', 'No')))
+    return text
+
+  def __write_back(self, key, value, text):
+    if json.dumps(value) != text:
+      self.cache[key] = (value, self.__store(key, value))
+
+  def __cache(self, key, value, text):
+    self.cache[key] = (value, text)
+    self.cache.move_to_end(key)
+    if len(self.cache) > self.cache_size:
+      key, (value, text) = self.cache.popitem(last=False)
+      if json.dumps(value) != text:
+        self.__store(key, value)
+        self.db.commit()
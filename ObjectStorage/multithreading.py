@@ -1,10 +1,87 @@
-from threading import Thread
-
-def run_tasks(funcs):
-  threads = []
-  for func in funcs:
-    t = Thread(target=func)
-    t.start()
-    threads.append(t)
-  for t in threads:
-    t.join()
\ No newline at end of file
+import queue
+import time
+from concurrent.futures import Future, wait
+from contextlib import contextmanager
+from threading import Thread, Lock, RLock
+
+MAX_PENDING = 64
+
+def wait_all(futures):
+  # wait for every future, then raise the first error if any failed
+  wait(futures)
+  return [future.result() for future in futures]
+
+class NodeExecutor:
+  # one long-lived worker with a bounded queue per node: calls to the same
+  # node run in submission order, calls to different nodes run in parallel,
+  # and submit blocks once a node has max_pending calls queued. If given,
+  # observe(node_id, call name, seconds) is told how long every call took
+  def __init__(self, max_pending=MAX_PENDING, observe=None):
+    self.max_pending = max_pending
+    self.observe = observe
+    self.queues = {}
+    self.workers = {}
+    self.lock = Lock()
+
+  def submit(self, node_id, fn, *args):
+    future = Future()
+    self.__queue(node_id).put((future, fn, args))
+    return future
+
+  def __queue(self, node_id):
+    with self.lock:
+      if node_id not in self.queues:
+        q = queue.Queue(maxsize=self.max_pending)
+        worker = Thread(target=self.__work, args=(node_id, q), daemon=True)
+        worker.start()
+        self.queues[node_id] = q
+        self.workers[node_id] = worker
+      return self.queues[node_id]
+
+  def __work(self, node_id, q):
+    while True:
+      item = q.get()
+      if item is None:
+        return
+      future, fn, args = item
+      if not future.set_running_or_notify_cancel():
+        continue
+      start = time.perf_counter()
+      try:
+        result = fn(*args)
+      except BaseException as e:
+        future.set_exception(e)
+      else:
+        future.set_result(result)
+      if self.observe is not None:
+        self.observe(node_id, getattr(fn, '__name__', 'call'), time.perf_counter() - start)
+
+  def shutdown(self):
+    with self.lock:
+      for q in self.queues.values():
+        q.put(None)
+      for worker in self.workers.values():
+        worker.join()
+      self.queues = {}
+      self.workers = {}
+
+class KeyLocks:
+  # one reentrant lock per key, kept only while a thread holds or waits
+  # for it
+  def __init__(self):
+    self.locks = {}
+    self.lock = Lock()
+
+  @contextmanager
+  def hold(self, key):
+    with self.lock:
+      entry = self.locks.setdefault(key, [RLock(), 0])
+      entry[1] += 1
+    try:
+      with entry[0]:
+        yield
+    finally:
+      with self.lock:
+        entry[1] -= 1
+        if entry[1] == 0:
+          del self.locks[key]
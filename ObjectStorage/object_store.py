@@ -1,260 +1,1033 @@
+import asyncio
+import itertools
 import json
 import os
+import time
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
-from .NodeStore import get_node_store
+from .NodeStore import NodeMap, get_async_node_store, FSYNC_NONE
+from .NodeStore.base_node_store import CHECKSUM_BLOCK, block_checksums
 from .parity import GaloisField
-from .multithreading import run_tasks
+from .meta_index import MetaIndex
+from .read_cache import ReadCache
+from .stats import StatsRecorder
+from .placement import Placement
+from .multithreading import NodeExecutor, KeyLocks, wait_all, MAX_PENDING
 
-CHUNK_SIZE = 16
+# chunk size of new stores
+CHUNK_SIZE = 4096
+# chunk size of stores created before the geometry was recorded
+LEGACY_CHUNK_SIZE = 16
+STREAM_STRIPES = 4096
+# columns per parallel encode/decode task
+ENCODE_BLOCK = 1 << 18
+# WriteMany packs objects smaller than this into shared pack objects
+PACK_SIZE = 1 << 22
+# keys per RebuildNode checkpoint, and how many of them rebuild at once
+REBUILD_BATCH = 64
+REBUILD_WORKERS = 4
+# per-column results of corruption localization besides a shard index
+CLEAN = -1
+UNCORRECTABLE = -2
 
 
 class ObjectStore:
-  def __init__(self, path="/tmp", node_num=5):
+  def __init__(self, path="/tmp", node_num=5, stream_stripes=None, max_pending_io=MAX_PENDING, encode_workers=1, node_type="simple", checksums=False, chunk_size=CHUNK_SIZE, w=8, cache_bytes=0, stats=False, stats_sink=None, fsync=FSYNC_NONE, stripe_width=None):
+    if w != 8:
+      raise ValueError(f"unsupported field width {w}, shards are stored as bytes")
     self.path = path
+    # an existing store keeps the geometry (node_num, stripe_width,
+    # chunk_size, w), node types and checksum setting it was created with
     self.node_num = node_num
+    # nodes per stripe, out of the node_num node pool
+    self.stripe_width = stripe_width or node_num
+    self.chunk_size = chunk_size
+    self.w = w
+    self.node_type = node_type
+    # fsync policy of "mmap" nodes
+    self.fsync = fsync
+    # nodes keep per-block checksums, so reads with every data node alive
+    # are verified without fetching parity
+    self.checksums = checksums
+    # when set, WriteToStore streams the file through write_stream
+    self.stream_stripes = stream_stripes
     self.meta = {}
     self.nodes = {}
-    self.stripe_size = (node_num - 2) * CHUNK_SIZE
-    self.gf = GaloisField(num_data_disk=self.node_num - 2, num_check_disk=2)
+    # decoded windows of hot keys, up to cache_bytes
+    self.cache = ReadCache(cache_bytes)
+    # asyncio views of self.nodes, created on first use
+    self.anodes = {}
+    # phase timings, counters and node latencies, see Stats()
+    self.stats = StatsRecorder(stats, stats_sink)
+    # per-node I/O workers, shared by every read and write of this store
+    self.executor = NodeExecutor(max_pending_io, self.stats.NodeCall if stats else None)
+    # writes, repairs and rebuilds of one key take turns, so none of them
+    # sees another's data written without its parity
+    self.key_locks = KeyLocks()
+    # GF kernels of independent column blocks run in these threads
+    self.encode_pool = None
+    if encode_workers > 1:
+      self.encode_pool = ThreadPoolExecutor(encode_workers)
     self.__init()
+    self.data_num = self.stripe_width - 2
+    self.stripe_size = (self.data_num) * self.chunk_size
+    self.gf = GaloisField(num_data_disk=self.data_num, num_check_disk=2, w=self.w)
+    # Q coefficient -> data shard index, for locating a corrupted shard
+    self.shard_of_coef = np.full(self.gf.x_to_w, UNCORRECTABLE, dtype=np.int16)
+    self.shard_of_coef[self.gf.vander[1]] = np.arange(self.data_num)
     
   def __init(self):
     # create directory
-    if not os.path.exists(self.path):
-      os.makedirs(self.path)
+    os.makedirs(self.path, exist_ok=True)
     
-    if not os.path.exists(os.path.join(self.path, 'obj_meta.json')):
-      # new object store
+    db_path = os.path.join(self.path, 'obj_meta.db')
+    json_path = os.path.join(self.path, 'obj_meta.json')
+    new_store = not os.path.exists(db_path) and not os.path.exists(json_path)
+    self.meta['keys'] = MetaIndex(db_path)
+    if new_store:
       self.__new_store()
-      with open(os.path.join(self.path, 'obj_meta.json'), 'w') as f:
-        f.write(json.dumps(self.meta))
     else:
       self.__load_meta()
-    pass
   
   def __new_store(self):
     self.meta['node_num'] = self.node_num
-    self.meta['keys'] = {}
-    for i in range(self.node_num):
-      path = os.path.join(self.path, f"node_{i}")
-      self.nodes[i] = get_node_store("simple", path)
+    self.meta['keys'].Set('geometry', self.__geometry())
+    self.placement = Placement(self.stripe_width, [1.0] * self.node_num)
+    self.meta['keys'].Set('placement', self.placement.State())
+    self.meta['keys'].Set('checksums', self.checksums)
+    descriptors = [{'type': self.node_type, 'path': f"node_{i}", 'checksums': self.checksums, 'fsync': self.fsync} for i in range(self.node_num)]
+    self.meta['keys'].Set('nodes', descriptors)
+    self.nodes = NodeMap(descriptors, self.path)
   
   def __load_meta(self):
-    with open(os.path.join(self.path, 'obj_meta.json'), 'r') as f:
-      s = f.read()
-      self.meta = json.loads(s)
+    json_path = os.path.join(self.path, 'obj_meta.json')
+    if os.path.exists(json_path):
+      # stores written before the metadata index kept everything in one
+      # JSON blob, move it into the index once
+      with open(json_path, 'r') as f:
+        meta = json.loads(f.read())
+      self.meta['keys'].Import(meta['keys'])
+      self.meta['keys'].Set('node_num', meta['node_num'])
+      os.rename(json_path, json_path + '.migrated')
+    geometry = self.meta['keys'].Get('geometry')
+    if geometry is None:
+      geometry = {'node_num': self.meta['keys'].Get('node_num'), 'chunk_size': LEGACY_CHUNK_SIZE, 'w': 8}
+      self.meta['keys'].Set('geometry', geometry)
+    self.meta['node_num'] = self.node_num = geometry['node_num']
+    self.stripe_width = geometry.get('stripe_width', self.node_num)
+    self.chunk_size = geometry['chunk_size']
+    self.w = geometry['w']
+    self.checksums = self.meta['keys'].Get('checksums', False)
+    # node stores are only attached once a read or write touches them
+    descriptors = self.meta['keys'].Get('nodes')
+    if descriptors is None:
+      descriptors = [{'type': 'simple', 'path': f"node_{i}"} for i in range(self.node_num)]
+      self.meta['keys'].Set('nodes', descriptors)
+    self.nodes = NodeMap(descriptors, self.path)
+    state = self.meta['keys'].Get('placement')
+    if state is None:
+      self.placement = Placement(self.stripe_width, [1.0] * self.node_num)
+    else:
+      self.placement = Placement.FromState(state)
+
+  def __geometry(self):
+    return {'node_num': self.node_num, 'stripe_width': self.stripe_width, 'chunk_size': self.chunk_size, 'w': self.w}
+
+  def AddNodes(self, count=1, capacity=1.0):
+    # grow the node pool with nodes like the existing ones; stripes keep
+    # their width, existing keys stay where they are and new keys spread
+    # over the larger pool. Returns the new node ids
+    descriptors = self.nodes.descriptors
+    node_ids = []
+    for _ in range(count):
+      node_id = self.placement.AddNode(capacity)
+      descriptor = {name: value for name, value in descriptors[0].items() if name != 'rebuilding'}
+      descriptor['path'] = f"node_{node_id}"
+      descriptors.append(descriptor)
+      node_ids.append(node_id)
+    self.meta['node_num'] = self.node_num = len(descriptors)
+    self.meta['keys'].Set('nodes', descriptors)
+    self.meta['keys'].Set('geometry', self.__geometry())
+    self.meta['keys'].Set('placement', self.placement.State())
+    return node_ids
+
+  def Reweight(self):
+    # steer new placement groups away from nodes holding more than their
+    # share of the stored bytes
+    self.placement.Reweight()
+    self.meta['keys'].Set('placement', self.placement.State())
   
   def __compute_parity(self, content):    
-    return self.gf.matmul(self.gf.vander, content)
-  
-  def __detect_data_corruption(self, content, size, parity):
-    dcontent = self.__pad_and_reshape(list(content), size)
-    dparity = self.__compute_parity(dcontent)
-    corrupt = []
-    for i in range(len(parity)):
-      if parity[i] != bytes(dparity[i,:].tolist()):
-        corrupt.append(i)
-    return corrupt
-    
+    return self.__matmul(self.gf.vander, content)
+
+  def __matmul(self, a, b):
+    # every column is an independent GF dot product, so large blocks are
+    # split by column range across the encode pool
+    cols = b.shape[1]
+    if self.encode_pool is None or cols < 2 * ENCODE_BLOCK:
+      return self.gf.matmul(a, b)
+    res = np.empty((a.shape[0], cols), dtype=self.gf.dtype)
+    def encode(start):
+      end = min(start + ENCODE_BLOCK, cols)
+      self.gf.matmul(a, b[:, start:end], out=res[:, start:end])
+    list(self.encode_pool.map(encode, range(0, cols, ENCODE_BLOCK)))
+    return res
   
-  def WriteToStore(self, input_file_path, key):
+  def __new_file_meta(self, key, chunk_size=None):
+    # the key's placement group decides its data and parity nodes
+    data_nodes, parity_nodes = self.placement.Place(key)
     file_meta = {
-      'data_nodes': [],
-      'parity_nodes': [],
+      'data_nodes': data_nodes,
+      'parity_nodes': parity_nodes,
       'error': 'No',
+      'chunk_size': chunk_size or self.chunk_size,
     }
-    # randomly select two nodes as parity nodes
-    node_ids = list(range(self.node_num))
-    parity_nodes = np.sort(np.random.choice(node_ids, size=2, replace=False)).tolist()
-    data_nodes = list(set(node_ids) - set(parity_nodes))
-    file_meta['data_nodes'] = data_nodes
-    file_meta['parity_nodes'] = parity_nodes
-    
+    return file_meta
+
+  def WriteToStore(self, input_file_path, key, chunk_size=None):
+    # chunk_size overrides the store's chunk size for this object
+    if self.stream_stripes is not None:
+      with open(input_file_path, 'rb') as f:
+        window_size = self.stream_stripes * (self.data_num) * (chunk_size or self.chunk_size)
+        return self.write_stream(key, iter(partial(f.read, window_size), b''), chunk_size)
+
+    file_meta = self.__new_file_meta(key, chunk_size)
     data = self.__distribute_data(input_file_path, file_meta)
-    parity = self.__compute_parity(data)
-    # for i in range(len(data_nodes)):
-    #   node_id = data_nodes[i]
-    #   self.nodes[node_id].Write(key, bytes(data[i,:].tolist()))
-    # for i in range(len(parity_nodes)):
-    #   node_id = parity_nodes[i]
-    #   self.nodes[node_id].Write(key, bytes(parity[i,:].tolist()))
-    node_ids = data_nodes + parity_nodes
-    contents = [bytes(data[i,:].tolist()) for i in range(len(data))]
-    contents += [bytes(parity[i,:].tolist()) for i in range(len(parity))]
-    self.__write_to_nodes(node_ids, key, contents)
-    
+    return self.__write_object(key, file_meta, data)
+
+  def put(self, key, data, chunk_size=None):
+    # store a bytes-like object, or everything a binary file object reads,
+    # without going through a file path
+    if hasattr(data, 'read'):
+      window_size = (self.stream_stripes or STREAM_STRIPES) * (self.data_num) * (chunk_size or self.chunk_size)
+      return self.write_stream(key, iter(partial(data.read, window_size), b''), chunk_size)
+    data = memoryview(data).cast('B')
+    if self.stream_stripes is not None:
+      return self.write_stream(key, [data], chunk_size)
+
+    file_meta = self.__new_file_meta(key, chunk_size)
+    file_meta['size'] = len(data)
+    s = self.__alloc_stripes(len(data), file_meta['chunk_size'])
+    s[:len(data)] = np.frombuffer(data, dtype=np.uint8)
+    return self.__write_object(key, file_meta, s.reshape(self.data_num, -1))
+
+  def __write_object(self, key, file_meta, data):
+    # encode and store a whole object held as a data matrix
+    with self.stats.Time('encode', data.nbytes):
+      parity = self.__compute_parity(data)
+    node_ids = file_meta['data_nodes'] + file_meta['parity_nodes']
+    contents = [memoryview(data[i]) for i in range(len(data))]
+    contents += [memoryview(parity[i]) for i in range(len(parity))]
+    with self.key_locks.hold(key):
+      self.__write_to_nodes(node_ids, key, contents)
+      self.meta['keys'][key] = file_meta
+      self.cache.Invalidate(key)
+    return True
+
+  def write_stream(self, key, iterable, chunk_size=None):
+    # encode a bounded window of stripes at a time and append each window's
+    # shard fragments to the nodes, so memory does not grow with the object
+    with self.key_locks.hold(key):
+      return self.__write_stream(key, iterable, chunk_size)
+
+  def __write_stream(self, key, iterable, chunk_size):
+    file_meta = self.__new_file_meta(key, chunk_size)
+    stripes = self.stream_stripes or STREAM_STRIPES
+    window = np.zeros(stripes * (self.data_num) * file_meta['chunk_size'], dtype=np.uint8)
+    fill, size, written = 0, 0, 0
+    for chunk in iterable:
+      chunk = np.frombuffer(chunk, dtype=np.uint8)
+      while len(chunk) > 0:
+        n = min(len(window) - fill, len(chunk))
+        window[fill:fill + n] = chunk[:n]
+        chunk = chunk[n:]
+        fill += n
+        size += n
+        if fill == len(window):
+          self.__write_window(key, file_meta, window, fill, written > 0)
+          written += 1
+          fill = 0
+    if fill > 0 or written == 0:
+      self.__write_window(key, file_meta, window, fill, written > 0)
+
+    file_meta['size'] = size
+    # bytes each node holds per window; the object is laid out row-major
+    # inside every window
+    file_meta['segment'] = stripes * file_meta['chunk_size']
     self.meta['keys'][key] = file_meta
+    self.cache.Invalidate(key)
+    return True
+
+  def __write_window(self, key, file_meta, window, fill, append):
+    shard_size = self.__shard_size(fill, file_meta['chunk_size'])
+    window[fill:shard_size * (self.data_num)] = 0 # padding
+    data = window[:shard_size * (self.data_num)].reshape(self.data_num, -1)
+    with self.stats.Time('encode', data.nbytes):
+      parity = self.__compute_parity(data)
+    node_ids = file_meta['data_nodes'] + file_meta['parity_nodes']
+    contents = [memoryview(data[i]) for i in range(len(data))]
+    contents += [memoryview(parity[i]) for i in range(len(parity))]
+    self.__write_to_nodes(node_ids, key, contents, append)
+
+  def WriteMany(self, items):
+    # pack small (key, content) objects into shared pack objects that are
+    # encoded once and stored as one file per node; larger objects are
+    # written on their own
+    pack, packed = [], 0
+    for key, content in items:
+      content = memoryview(content).cast('B')
+      if len(content) >= PACK_SIZE:
+        self.write_stream(key, [content])
+        continue
+      if packed + len(content) > PACK_SIZE:
+        self.__write_pack(pack, packed)
+        pack, packed = [], 0
+      pack.append((key, content))
+      packed += len(content)
+    if len(pack) > 0:
+      self.__write_pack(pack, packed)
+    return True
+
+  def __write_pack(self, pack, size):
+    pack_key = f"__pack_{self.meta['keys'].Next('packs')}"
+    file_meta = self.__new_file_meta(pack_key)
+    file_meta['size'] = size
+    window = self.__alloc_stripes(size, file_meta['chunk_size'])
+    members, offset = [], 0
+    for key, content in pack:
+      window[offset:offset + len(content)] = np.frombuffer(content, dtype=np.uint8)
+      members.append((key, offset, len(content)))
+      offset += len(content)
+    self.__write_window(pack_key, file_meta, window, size, False)
+
+    self.meta['keys'][pack_key] = file_meta
+    self.cache.Invalidate(pack_key)
+    # a packed object shares the nodes and error state of its pack
+    self.meta['keys'].Import({key: {
+      'pack': pack_key,
+      'offset': offset,
+      'size': length,
+      'data_nodes': file_meta['data_nodes'],
+      'parity_nodes': file_meta['parity_nodes'],
+      'error': 'No',
+    } for key, offset, length in members})
+    for key, _, _ in members:
+      self.cache.Invalidate(key)
+
+  def WriteRange(self, key, offset, data):
+    # overwrite [offset, offset + len(data)) of an existing object in place;
+    # only the stripe columns holding it are read and only the touched shard
+    # ranges and the same ranges of P and Q are written, parity is patched
+    # with the data delta d as P ^= d and Q ^= g^i * d. Shards on down nodes miss the update: they are recorded
+    # as 'stale' first and read as erasures until RecoverCorruptedData or
+    # RebuildNode rewrites them. A write to a down data shard is refused if
+    # another shard of the stripe is down too. With every shard up, the
+    # touched columns are verified and repaired before the delta is taken;
+    # IOError is raised if they are uncorrectable
+    if key not in self.meta['keys']:
+      return False
+    key_meta = self.meta['keys'][key]
+    data = np.frombuffer(memoryview(data).cast('B'), dtype=np.uint8)
+    if offset < 0 or offset + len(data) > key_meta['size']:
+      return False
+    if 'pack' in key_meta:
+      return self.WriteRange(key_meta['pack'], key_meta['offset'] + offset, data)
+    with self.key_locks.hold(key):
+      key_meta = self.meta['keys'][key]
+      _, _, corrupted_disk_list = self.__node_states(key_meta)
+      if len(corrupted_disk_list) > 2:
+        return False
+      pieces = list(self.__range_pieces(key_meta, offset, data))
+      touched = {i for i, _, _ in pieces}
+      missed = [i for i in corrupted_disk_list if i in touched or i >= self.data_num]
+      if len(corrupted_disk_list) > 1 and touched & set(corrupted_disk_list):
+        # the new data would only be held by the surviving parity
+        return False
+      if len(missed) > 0:
+        self.__mark_stale(key, missed)
+        key_meta = self.meta['keys'][key]
+
+      for i, shard_offset, new in pieces:
+        self.__patch_shard(key, key_meta, i, shard_offset, new)
+      self.cache.Invalidate(key)
     return True
 
+  def __mark_stale(self, key, shards):
+    # record the nodes of the given shard indices as stale and flag the key
+    # for RecoverCorruptedData
+    key_meta = self.meta['keys'][key]
+    node_ids = key_meta['data_nodes'] + key_meta['parity_nodes']
+    key_meta['stale'] = sorted(set(key_meta.get('stale', [])) | {node_ids[i] for i in shards})
+    key_meta['error'] = 'Data' if shards[0] < self.data_num else 'Parity'
+    self.meta['keys'][key] = key_meta
+
+  def __patch_shard(self, key, key_meta, i, shard_offset, new):
+    data_node = key_meta['data_nodes'][i]
+    parity_rows = [j for j in range(2) if self.__available(key_meta, key_meta['parity_nodes'][j])]
+    parity_nodes = [key_meta['parity_nodes'][j] for j in parity_rows]
+    data_alive = self.__available(key_meta, data_node)
+    repaired = []
+    if len(self.__node_states(key_meta)[2]) == 0:
+      # the delta is only as good as the old data it is taken from, so the
+      # touched columns are verified and repaired across the stripe first
+      old, parity, repaired = self.__verified_columns(key, key_meta, i, shard_offset, len(new))
+    elif data_alive:
+      old = self.__read_shards([data_node] + parity_nodes, key, shard_offset, len(new))
+      old, parity = old[0], old[1:]
+    else:
+      old = self.__load_window(key, shard_offset, len(new))[i]
+      parity = self.__read_shards(parity_nodes, key, shard_offset, len(new))
+    delta = old ^ new
+    for row, j in zip(parity, parity_rows):
+      row ^= self.gf.mult_row(self.gf.vander[j][i], delta)
+
+    futures = []
+    if data_alive:
+      futures.append(self.executor.submit(data_node, self.nodes[data_node].WriteRange, key, shard_offset, memoryview(new)))
+    for node_id, row in zip(parity_nodes, parity):
+      futures.append(self.executor.submit(node_id, self.nodes[node_id].WriteRange, key, shard_offset, memoryview(row)))
+    for node_id, row in repaired:
+      futures.append(self.executor.submit(node_id, self.nodes[node_id].WriteRange, key, shard_offset, memoryview(row)))
+    wait_all(futures)
+
+  def __verified_columns(self, key, key_meta, i, shard_offset, length):
+    # reads the columns [shard_offset, shard_offset + length) of every shard
+    # and repairs them; returns the old data of shard i, the parity rows and
+    # the (node id, row) of the other data shards that were repaired.
+    # Raises IOError if a column is uncorrectable
+    content = self.__read_shards(key_meta['data_nodes'], key, shard_offset, length)
+    parity = self.__read_shards(key_meta['parity_nodes'], key, shard_offset, length)
+    located = self.__locate_corruption(content, parity)
+    if located is None:
+      return content[i], parity, []
+    bad, syndrome = located
+    if (bad == UNCORRECTABLE).any():
+      self.__set_error(key, 'Data')
+      raise IOError(f"uncorrectable corruption in {key}")
+    self.__repair(content, parity, bad, syndrome)
+    repaired = [(key_meta['data_nodes'][j], content[j]) for j in np.unique(bad) if 0 <= j < self.data_num and j != i]
+    return content[i], parity, repaired
+
   def ReadFromStore(self, key, output_file_path):
     if key not in self.meta['keys']:
       return False
+    _, _, corrupted_disk_list = self.__node_states(self.meta['keys'][key])
+    if len(corrupted_disk_list) > 2:
+      return False
+
+    with open(output_file_path, 'wb') as f:
+      for content in self.iter_read(key):
+        with self.stats.Time('output_write', len(content)):
+          f.write(content)
+    return True
+
+  def iter_read(self, key):
+    # yield the object window by window, decoding each window on its own
+    if key not in self.meta['keys']:
+      raise KeyError(key)
+    key_meta = self.meta['keys'][key]
+    if 'pack' in key_meta:
+      yield self.__read_member(key, key_meta)
+      return
+
+    remain = key_meta['size']
+    for offset, length in self.__windows(key_meta):
+      content = self.__read_window(key, offset, length)
+      if content is None:
+        raise IOError(f"too many failed nodes to read {key}")
+      view = self.__object_view(content, min(remain, content.size))
+      remain -= len(view)
+      yield view
+
+  def get(self, key):
+    # the whole object as a memoryview; an object written in one piece is
+    # returned without copying its decoded window
+    if key not in self.meta['keys']:
+      raise KeyError(key)
+    key_meta = self.meta['keys'][key]
+    if 'pack' in key_meta:
+      return self.__read_member(key, key_meta)
+    windows = list(self.__windows(key_meta))
+    if len(windows) != 1:
+      buf = bytearray(key_meta['size'])
+      self.readinto(key, buf)
+      return memoryview(buf)
+    content = self.__read_window(key, *windows[0])
+    if content is None:
+      raise IOError(f"too many failed nodes to read {key}")
+    return self.__object_view(content, key_meta['size'])
+
+  def __read_member(self, key, key_meta):
+    # a packed object is cut out of its pack; only the shard columns that
+    # hold it are read, verified and decoded, not the whole pack window
+    pack_key = key_meta['pack']
+    pack_meta = self.meta['keys'][pack_key]
+    content = np.empty(key_meta['size'], dtype=np.uint8)
+    for i, shard_offset, dest in self.__range_pieces(pack_meta, key_meta['offset'], content):
+      columns = self.__read_window(pack_key, shard_offset, len(dest))
+      if columns is None:
+        raise IOError(f"too many failed nodes to read {key}")
+      dest[:] = columns[i]
+    return memoryview(content)
 
+  def readinto(self, key, buf):
+    # copy the object into the caller's buffer, at most len(buf) bytes;
+    # returns the number of bytes copied
+    buf = memoryview(buf).cast('B')
+    copied = 0
+    for content in self.iter_read(key):
+      n = min(len(content), len(buf) - copied)
+      buf[copied:copied + n] = content[:n]
+      copied += n
+      if copied == len(buf):
+        break
+    return copied
+
+  def __windows(self, key_meta):
+    # (offset, length) shard ranges that each hold a contiguous part of the
+    # object; objects written in one piece are a single window, empty
+    # objects have none
+    shard_size = self.__shard_size(key_meta['size'], self.__chunk_size(key_meta))
+    if shard_size == 0:
+      return
+    segment = key_meta.get('segment', shard_size)
+    for offset in range(0, shard_size, segment):
+      yield offset, min(segment, shard_size - offset)
+
+  def ReadRange(self, key, offset, length):
+    # read only the shard ranges that cover [offset, offset + length); data
+    # on alive nodes is trusted, missing ranges decode just their columns
+    if key not in self.meta['keys']:
+      return None
     key_meta = self.meta['keys'][key]
+    _, _, corrupted_disk_list = self.__node_states(key_meta)
+    if len(corrupted_disk_list) > 2:
+      return None
+    # clip [offset, offset + length) to the object
+    size = key_meta['size']
+    end = min(offset + length, size)
+    offset = min(max(0, offset), size)
+    length = max(0, end - offset)
+    if 'pack' in key_meta:
+      return self.ReadRange(key_meta['pack'], key_meta['offset'] + offset, length)
+    content = np.empty(length, dtype=np.uint8)
+
+    futures, missing, reads = [], [], []
+    for i, shard_offset, dest in self.__range_pieces(key_meta, offset, content):
+      node_id = key_meta['data_nodes'][i]
+      if not self.__available(key_meta, node_id):
+        missing.append((i, shard_offset, dest))
+        continue
+      node = self.nodes[node_id]
+      futures.append(self.executor.submit(node_id, node.ReadInto, key, memoryview(dest), shard_offset))
+      reads.append((node_id, len(dest)))
+    self.__check_reads(key, reads, wait_all(futures))
+    for i, shard_offset, dest in missing:
+      dest[:] = self.__read_window(key, shard_offset, len(dest))[i]
+    return memoryview(content)
+
+  def __range_pieces(self, key_meta, offset, content):
+    # split the logical range held by content into (data shard index, shard
+    # offset, destination view) pieces
+    k = self.data_num
+    end = offset + len(content)
+    for window_offset, window_length in self.__windows(key_meta):
+      base = window_offset * k
+      lo = max(offset, base)
+      hi = min(end, base + window_length * k)
+      if lo >= hi:
+        continue
+      for i in range((lo - base) // window_length, (hi - 1 - base) // window_length + 1):
+        row_lo = max(lo, base + i * window_length)
+        row_hi = min(hi, base + (i + 1) * window_length)
+        shard_offset = window_offset + row_lo - base - i * window_length
+        yield i, shard_offset, content[row_lo - offset:row_hi - offset]
+
+  def __available(self, key_meta, node_id):
+    # a node serves key_meta's shard if it is alive and its shard is current
+    return self.nodes[node_id].Alive() and node_id not in key_meta.get('stale', ())
+
+  def __node_states(self, key_meta):
     data_nodes = key_meta['data_nodes']
     parity_nodes = key_meta['parity_nodes']
-    file_size = key_meta['size']
-    # detect aliveness
+    # detect aliveness, stale shards count as lost
     alive_data_nodes = []
     corrupted_data_nodes = []
     alive_parity_nodes = []
     corrupted_parity_nodes = []
     for i in range(len(data_nodes)):
       node_id = data_nodes[i]
-      if self.nodes[node_id].Alive():
+      if self.__available(key_meta, node_id):
         alive_data_nodes.append(node_id)
       else:
         corrupted_data_nodes.append(i)
     
     for i in range(len(parity_nodes)):
       node_id = parity_nodes[i]
-      if self.nodes[node_id].Alive():
+      if self.__available(key_meta, node_id):
         alive_parity_nodes.append(node_id)
       else:
-        corrupted_parity_nodes.append(i + self.node_num - 2)
+        corrupted_parity_nodes.append(i + self.data_num)
     
     corrupted_disk_list = sorted(corrupted_data_nodes + corrupted_parity_nodes)
-    
-    if len(alive_data_nodes) == len(data_nodes):
-      content, parity = [], []
-      # for node_id in alive_data_nodes:
-      #   content.append(self.nodes[node_id].Read(key))
-      content = self.__read_from_nodes(alive_data_nodes, key)
-      parity = self.__read_from_nodes(alive_parity_nodes, key)
-
-      bcontent = bytes(b''.join(content))[:file_size]
-      corrupt = []
-      if len(alive_parity_nodes) == 2:
+    return alive_data_nodes, alive_parity_nodes, corrupted_disk_list
+
+  def __read_window(self, key, offset, length):
+    # returns the data_num x length data matrix of a shard range, or
+    # None if too many nodes are down; served from the read cache if it
+    # holds the range
+    content = self.cache.Get(key, offset, length)
+    if content is None:
+      generation = self.cache.Generation()
+      content = self.__load_window(key, offset, length)
+      if content is not None:
+        self.cache.Put(key, offset, length, content, generation)
+    return content
+
+  def __load_window(self, key, offset, length):
+    key_meta = self.meta['keys'][key]
+    alive_data_nodes, alive_parity_nodes, corrupted_disk_list = self.__node_states(key_meta)
+    if len(corrupted_disk_list) > 2:
+      return None
+
+    if self.checksums and len(alive_data_nodes) == len(key_meta['data_nodes']) and self.__block_aligned(key_meta, offset, length):
+      content = self.__verify_window(key, key_meta, offset, length, alive_parity_nodes, corrupted_disk_list)
+      if content is not None:
+        return content
+
+    node_ids = self.__xor_node_ids(key_meta, corrupted_disk_list)
+    if node_ids is not None:
+      content = self.__read_shards(node_ids, key, offset, length)
+      return self.__xor_rebuild(content, corrupted_disk_list[0])
+
+    content = self.__read_shards(alive_data_nodes, key, offset, length)
+    parity = self.__read_shards(alive_parity_nodes, key, offset, length)
+    return self.__decode_window(key, key_meta, content, parity, corrupted_disk_list)
+
+  def __xor_node_ids(self, key_meta, corrupted_disk_list):
+    # with one data shard lost and P alive, the nodes to read for an XOR
+    # rebuild: the data nodes with P in place of the lost one. None if the
+    # window needs the general decode
+    if len(corrupted_disk_list) == 0 or corrupted_disk_list[0] >= self.data_num:
+      return None
+    if len(corrupted_disk_list) == 2 and corrupted_disk_list[1] != self.data_num + 1:
+      return None
+    node_ids = list(key_meta['data_nodes'])
+    node_ids[corrupted_disk_list[0]] = key_meta['parity_nodes'][0]
+    return node_ids
+
+  def __xor_rebuild(self, content, lost):
+    # P is the XOR of the data shards, so XOR-ing the surviving shards into
+    # the P row leaves the lost shard there
+    self.stats.Add('degraded_reads')
+    with self.stats.Time('xor_decode', content.nbytes):
+      for i in range(len(content)):
+        if i != lost:
+          content[lost] ^= content[i]
+    return content
+
+  def __block_aligned(self, key_meta, offset, length):
+    # whether [offset, offset + length) covers whole checksum blocks
+    return offset % CHECKSUM_BLOCK == 0 and (length % CHECKSUM_BLOCK == 0 or offset + length == self.__shard_size(key_meta['size'], self.__chunk_size(key_meta)))
+
+  def __verify_window(self, key, key_meta, offset, length, alive_parity_nodes, corrupted_disk_list):
+    # read only the data shards and check every block against the checksums
+    # their nodes stored; parity is read and decoded only for the blocks
+    # that fail. Returns None if a node keeps no checksums for key
+    data_nodes = key_meta['data_nodes']
+    first = offset // CHECKSUM_BLOCK
+    count = -(-length // CHECKSUM_BLOCK)
+    futures = [self.executor.submit(node_id, self.nodes[node_id].Checksums, key, first, count) for node_id in data_nodes]
+    content = self.__read_shards(data_nodes, key, offset, length)
+    stored = wait_all(futures)
+    if any(sums is None or len(sums) != count for sums in stored):
+      return None
+
+    failed = np.array([block_checksums(row) != sums for row, sums in zip(content, stored)])
+    for block in np.flatnonzero(failed.any(axis=0)):
+      # bad blocks are treated as erasures next to the crashed parity nodes
+      erased = sorted([int(i) for i in np.flatnonzero(failed[:, block])] + corrupted_disk_list)
+      if len(erased) > 2:
+        raise IOError(f"uncorrectable corruption in {key}")
+      self.__set_error(key, 'Data')
+      start = block * CHECKSUM_BLOCK
+      end = min(start + CHECKSUM_BLOCK, length)
+      survivors = [i for i in range(len(data_nodes)) if i not in erased]
+      parity = self.__read_shards(alive_parity_nodes, key, offset + start, end - start)
+      content[:, start:end] = self.__data_rebuild(content[survivors, start:end], parity, erased)
+    return content
+
+  def __set_error(self, key, error):
+    key_meta = self.meta['keys'][key]
+    key_meta['error'] = error
+    self.meta['keys'][key] = key_meta
+    if error != 'No':
+      self.cache.Invalidate(key)
+
+  def __decode_window(self, key, key_meta, content, parity, corrupted_disk_list):
+    # content and parity hold the alive data and parity shards of a window
+    if len(content) == len(key_meta['data_nodes']):
+      if len(parity) < 2:
         # if the parity node crashes, we don't know which disk is corrupted
-        corrupt = self.__detect_data_corruption(bcontent, file_size, parity)
-      parity = [list(parity[i]) for i in range(len(parity))]
-      content = [list(content[i]) for i in range(len(content))]
-      if len(corrupt) == 0:
-        self.__write_to_file(output_file_path, bcontent)
-      elif len(corrupt) == 1:
-        # parity driven corruption
-        self.meta['keys'][key]['error'] = 'Parity'
-        self.__write_to_file(output_file_path, bcontent)
-      else:
+        return content
+      with self.stats.Time('verify', content.nbytes):
+        located = self.__locate_corruption(content, parity)
+      if located is None:
+        return content
+      self.stats.Add('corrupt_windows')
+      bad, syndrome = located
+      k = len(content)
+      if ((bad >= 0) & (bad < k)).any() or (bad == UNCORRECTABLE).any():
         # data driven corruption
-        # TODO: detect which disk is corrupted
-        self.meta['keys'][key]['error'] = 'Data'
-        corrupted_disk_list.append(0)
-        content.pop(corrupted_disk_list[0])
-        rebuild_content = self.__data_rebuild(content, parity, corrupted_disk_list, file_size)
-        self.__write_to_file(output_file_path, rebuild_content)
-      return True
+        self.__set_error(key, 'Data')
+      else:
+        # parity driven corruption
+        self.__set_error(key, 'Parity')
+      if (bad == UNCORRECTABLE).any():
+        raise IOError(f"uncorrectable corruption in {key}")
+      self.__repair(content, parity, bad, syndrome)
+      return content
 
-    if len(alive_data_nodes) >= len(data_nodes) - 2:
-      # erasure failure
-      content = self.__read_from_nodes(alive_data_nodes, key)
-      parity = self.__read_from_nodes(alive_parity_nodes, key)
-      # for node_id in alive_data_nodes:
-      #   content.append(list(self.nodes[node_id].Read(key)))
-      # for node_id in alive_parity_nodes:
-      #   parity.append(list(self.nodes[node_id].Read(key)))
-      content = [list(content[i]) for i in range(len(content))]
-      parity = [list(parity[i]) for i in range(len(parity))]
-      # print('corrupted: ', corrupted_disk_list)
-      rebuild_content = self.__data_rebuild(content, parity, corrupted_disk_list, file_size)
-      self.__write_to_file(output_file_path, rebuild_content)
+    # erasure failure
+    self.stats.Add('degraded_reads')
+    return self.__data_rebuild(content, parity, corrupted_disk_list)
+
+  async def awrite(self, input_file_path, key):
+    # coroutine counterpart of WriteToStore, shard writes are gathered on the
+    # running event loop
+    file_meta = self.__new_file_meta(key)
+    data = self.__distribute_data(input_file_path, file_meta)
+    with self.stats.Time('encode', data.nbytes):
+      parity = self.__compute_parity(data)
+    node_ids = file_meta['data_nodes'] + file_meta['parity_nodes']
+    contents = [memoryview(data[i]) for i in range(len(data))]
+    contents += [memoryview(parity[i]) for i in range(len(parity))]
+    await asyncio.gather(*[self.__anode(node_ids[i]).Write(key, contents[i]) for i in range(len(node_ids))])
+
+    self.meta['keys'][key] = file_meta
+    self.cache.Invalidate(key)
+    return True
+
+  async def aread(self, key, output_file_path):
+    # coroutine counterpart of ReadFromStore
+    if key not in self.meta['keys']:
+      return False
+    key_meta = self.meta['keys'][key]
+    _, _, corrupted_disk_list = self.__node_states(key_meta)
+    if len(corrupted_disk_list) > 2:
+      return False
+
+    if 'pack' in key_meta:
+      # packed objects are small, read them through their pack
+      with open(output_file_path, 'wb') as f:
+        f.write(self.__read_member(key, key_meta))
       return True
-    
-    return False
-
-  def __data_rebuild(self, content, parity, corrupted_disk_list, file_size):
-    A = np.concatenate([np.eye(self.node_num - 2, dtype=int), self.gf.vander], axis=0)
-    A_ = np.delete(A, obj=corrupted_disk_list, axis=0)
-    E_ = np.concatenate([np.asarray(content), np.asarray(parity)], axis=0)
-    # print(A_.shape)
-    # print(E_.shape)
-    D = self.gf.matmul(self.gf.inverse(A_), E_)
-    C = self.gf.matmul(self.gf.vander, D)
-    E = np.concatenate([D, C], axis=0)
-    
-    rebuild_content = []
-    for i in range(self.node_num - 2):
-      rebuild_content.append(bytes(E[i,:].tolist()))
 
-    rebuild_content = bytes(b''.join(rebuild_content))[:file_size]
-    return rebuild_content
+    remain = key_meta['size']
+    with open(output_file_path, 'wb') as f:
+      for offset, length in self.__windows(key_meta):
+        content = self.cache.Get(key, offset, length)
+        if content is None:
+          generation = self.cache.Generation()
+          alive_data_nodes, alive_parity_nodes, corrupted_disk_list = self.__node_states(key_meta)
+          node_ids = self.__xor_node_ids(key_meta, corrupted_disk_list)
+          if node_ids is not None:
+            content = self.__xor_rebuild(await self.__aread_shards(node_ids, key, offset, length), corrupted_disk_list[0])
+          else:
+            content, parity = await asyncio.gather(
+              self.__aread_shards(alive_data_nodes, key, offset, length),
+              self.__aread_shards(alive_parity_nodes, key, offset, length))
+            content = self.__decode_window(key, key_meta, content, parity, corrupted_disk_list)
+          self.cache.Put(key, offset, length, content, generation)
+        view = self.__object_view(content, min(remain, content.size))
+        remain -= len(view)
+        f.write(view)
+    return True
+
+  def __anode(self, node_id):
+    if node_id not in self.anodes:
+      self.anodes[node_id] = get_async_node_store(self.nodes[node_id])
+    return self.anodes[node_id]
+
+  async def __aread_shards(self, node_ids, key, offset, length):
+    content = np.empty((len(node_ids), length), dtype=np.uint8)
+    counts = await asyncio.gather(*[self.__anode(node_ids[i]).ReadInto(key, memoryview(content[i]), offset) for i in range(len(node_ids))])
+    self.__check_reads(key, [(node_id, length) for node_id in node_ids], counts)
+    return content
+
+  def __data_rebuild(self, content, parity, corrupted_disk_list):
+    # returns the data_num x shard_size data matrix
+    with self.stats.Time('decode', content.nbytes + parity.nbytes):
+      E_ = np.concatenate([content, parity], axis=0)
+      return self.__matmul(self.gf.decode_matrix(corrupted_disk_list), E_)
 
   def RecoverCorruptedData(self):
-    for key in self.meta['keys']:
+    # rewrite the stale shards of every flagged key from the current ones,
+    # then locate the bad columns through the syndromes and rewrite only the
+    # stripes that contain them
+    for key in self.meta['keys'].Errors():
+      with self.key_locks.hold(key):
+        key_meta = self.meta['keys'][key]
+        if not all(self.nodes[node_id].Alive() for node_id in key_meta['data_nodes'] + key_meta['parity_nodes']):
+          # every shard is needed to locate the corruption
+          continue
+        if any(self.__rebuild_locked(node_id, key) is None for node_id in key_meta.get('stale', [])):
+          continue
+        key_meta = self.meta['keys'][key]
+        repaired = True
+        for offset, length in self.__windows(key_meta):
+          repaired = self.__repair_window(key, key_meta, offset, length) is not None and repaired
+        if repaired:
+          self.__set_error(key, 'No')
+        self.cache.Invalidate(key)
+
+  def ScrubKey(self, key, throttle=None):
+    # verify every window of key against its parity and repair what is
+    # correctable; throttle(nbytes) is called after each window is read.
+    # Returns the status ('clean', 'repaired', 'uncorrectable' or 'skipped'
+    # for packed members and keys with a node down) and the shard bytes read
+    if key not in self.meta['keys']:
+      return 'skipped', 0
+    key_meta = self.meta['keys'][key]
+    _, _, corrupted_disk_list = self.__node_states(key_meta)
+    if 'pack' in key_meta or len(corrupted_disk_list) > 0:
+      return 'skipped', 0
+
+    status, scanned = 'clean', 0
+    layout = self.__layout(key_meta)
+    for offset, length in self.__windows(key_meta):
+      # each window is verified and repaired between two writes of the
+      # key; the scan is dropped if the key was rewritten or a node went
+      # down meanwhile. Throttling happens outside the lock
+      with self.key_locks.hold(key):
+        key_meta = self.meta['keys'][key]
+        _, _, corrupted_disk_list = self.__node_states(key_meta)
+        if self.__layout(key_meta) != layout or len(corrupted_disk_list) > 0:
+          return 'skipped', scanned
+        repaired = self.__repair_window(key, key_meta, offset, length)
+      if repaired is None:
+        status = 'uncorrectable'
+      elif repaired > 0 and status == 'clean':
+        status = 'repaired'
+      scanned += length * self.stripe_width
+      if throttle is not None:
+        throttle(length * self.stripe_width)
+    with self.key_locks.hold(key):
+      if status == 'uncorrectable':
+        self.__set_error(key, 'Data')
+      elif self.meta['keys'][key]['error'] != 'No':
+        self.__set_error(key, 'No')
+      if status != 'clean':
+        self.cache.Invalidate(key)
+    return status, scanned
+
+  def __layout(self, key_meta):
+    # what places a key's shards and windows; a rewrite may change it
+    return (key_meta['data_nodes'], key_meta['parity_nodes'], key_meta['size'], key_meta.get('segment'), self.__chunk_size(key_meta))
+
+  def RebuildNode(self, node_id, batch=REBUILD_BATCH, workers=REBUILD_WORKERS):
+    # reconstruct every shard node_id holds, e.g. after its disk was
+    # replaced. The node stays down, also across restarts, until all its
+    # shards are rebuilt; progress is checkpointed after every batch of
+    # keys, so calling RebuildNode again resumes an interrupted rebuild.
+    # Returns the keys and bytes rebuilt, the keys that could not be rebuilt
+    # and the throughput
+    descriptors = self.nodes.descriptors
+    descriptors[node_id]['rebuilding'] = True
+    self.meta['keys'].Set('nodes', descriptors)
+    node = self.nodes[node_id]
+    node.Crash()
+
+    checkpoint = f"rebuild_{node_id}"
+    progress = self.meta['keys'].Get(checkpoint) or {'cursor': None, 'keys': 0, 'bytes': 0, 'failed': 0}
+    start, rebuilt = time.monotonic(), 0
+    keys = self.meta['keys'].Scan(progress['cursor'])
+    with ThreadPoolExecutor(workers) as pool:
+      while True:
+        batch_keys = list(itertools.islice(keys, batch))
+        if len(batch_keys) == 0:
+          break
+        for written in pool.map(partial(self.__rebuild_shard, node_id), batch_keys):
+          if written is None:
+            progress['failed'] += 1
+          elif written > 0:
+            progress['keys'] += 1
+            progress['bytes'] += written
+            rebuilt += written
+        progress['cursor'] = batch_keys[-1]
+        self.meta['keys'].Set(checkpoint, progress)
+    seconds = time.monotonic() - start
+
+    self.meta['keys'].Set(checkpoint, None)
+    if progress['failed'] == 0:
+      del descriptors[node_id]['rebuilding']
+      self.meta['keys'].Set('nodes', descriptors)
+      node.Recover()
+    del progress['cursor']
+    progress['seconds'] = seconds
+    progress['MB/s'] = rebuilt / seconds / 1e6 if seconds > 0 else 0.0
+    return progress
+
+  def __rebuild_shard(self, node_id, key):
+    # rewrite the shard of key held by node_id from the other shards;
+    # returns the bytes written, 0 if the node holds no shard of key, or
+    # None if too many other shards are lost
+    with self.key_locks.hold(key):
+      return self.__rebuild_locked(node_id, key)
+
+  def __rebuild_locked(self, node_id, key):
+    key_meta = self.meta['keys'][key]
+    k = self.data_num
+    if 'pack' in key_meta:
+      # packed members are rebuilt with their pack
+      return 0
+    if node_id in key_meta['data_nodes']:
+      row = key_meta['data_nodes'].index(node_id)
+    elif node_id in key_meta['parity_nodes']:
+      row = k + key_meta['parity_nodes'].index(node_id)
+    else:
+      return 0
+
+    node = self.nodes[node_id]
+    node.Write(key, b'')
+    written = 0
+    for offset, length in self.__windows(key_meta):
+      try:
+        content = self.__load_window(key, offset, length)
+      except IOError:
+        content = None
+      if content is None:
+        return None
+      shard = content[row] if row < k else self.__compute_parity(content)[row - k]
+      node.Append(key, memoryview(shard))
+      written += length
+    if node_id in key_meta.get('stale', []):
       key_meta = self.meta['keys'][key]
-      if self.meta['keys'][key]['error'] == 'Data':
-        corrupted_disk_list = [0]
-        content, parity = [], []
-        # idx = 0
-        # for node_id in key_meta['data_nodes']:
-        #   if idx == 0:
-        #     idx += 1
-        #     continue
-        #   content.append(list(self.nodes[node_id].Read(key)))
-        nodes = key_meta['data_nodes']
-        nodes = nodes[1:]
-        content = self.__read_from_nodes(nodes, key)
-        parity = self.__read_from_nodes(key_meta['parity_nodes'], key)
-        # for node_id in key_meta['parity_nodes']:
-        #   parity.append(list(self.nodes[node_id].Read(key)))
-        content = [list(content[i]) for i in range(len(content))]
-        parity = [list(parity[i]) for i in range(len(parity))]
-        rebuild_content = self.__data_rebuild(content, parity, corrupted_disk_list, key_meta['size'])
-        real_content = self.__distribute_real_data(rebuild_content)
-        self.nodes[key_meta['data_nodes'][0]].Write(key, bytes(real_content[0,:].tolist()))
-        self.meta['keys'][key]['error'] = 'No'
-      elif self.meta['keys'][key]['error'] == 'Parity':
-        content, parity = [], []
-        # for node_id in key_meta['data_nodes']:
-        #   content.append(list(self.nodes[node_id].Read(key)))
-        content = self.__read_from_nodes(key_meta['data_nodes'], key)
-        content = [list(content[i]) for i in range(len(content))]
-        content = np.asarray(content).reshape(-1).tolist()
-        parity = self.__compute_parity(self.__pad_and_reshape(content, len(content)))
-        # idx = 0
-        # for node_id in key_meta['parity_nodes']:
-        #   self.nodes[node_id].Write(key, bytes(parity[idx,:].tolist()))
-        #   idx += 1
-        parity_contents = [bytes(parity[i,:].tolist()) for i in range(len(parity))]
-        self.__write_to_nodes(key_meta['parity_nodes'], key, parity_contents)
-        self.meta['keys'][key]['error'] = 'No'
-  
-  def __write_to_file(self, file_path, content):
-    with open(file_path, 'wb') as f:
-      f.write(content)
-      
+      key_meta['stale'] = [stale for stale in key_meta['stale'] if stale != node_id]
+      if len(key_meta['stale']) == 0:
+        del key_meta['stale']
+      self.meta['keys'][key] = key_meta
+    return written
+
+  def __repair_window(self, key, key_meta, offset, length):
+    # returns the number of repaired columns, or None if the window has
+    # uncorrectable columns
+    content = self.__read_shards(key_meta['data_nodes'], key, offset, length)
+    parity = self.__read_shards(key_meta['parity_nodes'], key, offset, length)
+    located = self.__locate_corruption(content, parity)
+    if located is None:
+      return 0
+    bad, syndrome = located
+    if (bad == UNCORRECTABLE).any():
+      return None
+    self.__repair(content, parity, bad, syndrome)
+
+    # bad uses the same shard numbering as data_nodes + parity_nodes
+    node_ids = key_meta['data_nodes'] + key_meta['parity_nodes']
+    shards = list(content) + list(parity)
+    futures = []
+    for i in range(len(node_ids)):
+      node = self.nodes[node_ids[i]]
+      for start, end in self.__stripe_runs(bad == i, self.__chunk_size(key_meta)):
+        futures.append(self.executor.submit(node_ids[i], node.WriteRange, key, offset + start, memoryview(shards[i][start:end])))
+    wait_all(futures)
+    return int((bad != CLEAN).sum())
+
+  def __locate_corruption(self, content, parity):
+    # one pass over a window computing the P and Q syndromes of every
+    # column. With a single bad shard z in a column, Sp is its error and
+    # Sq / Sp = vander[1][z]; only Sp or only Sq set means P or Q is bad.
+    # Returns None if the window is clean, else the bad shard of every
+    # column (CLEAN, data shard index, k for P, k + 1 for Q or
+    # UNCORRECTABLE) and Sp
+    syndrome = self.__compute_parity(content)
+    syndrome ^= parity
+    if not syndrome.any():
+      return None
+    k = self.data_num
+    sp, sq = syndrome[0], syndrome[1]
+    bad = np.full(sp.shape, CLEAN, dtype=np.int16)
+    bad[(sp != 0) & (sq == 0)] = k
+    bad[(sp == 0) & (sq != 0)] = k + 1
+    both = (sp != 0) & (sq != 0)
+    bad[both] = self.shard_of_coef[self.gf.div_rows(sq[both], sp[both])]
+    return bad, sp
+
+  def __repair(self, content, parity, bad, syndrome):
+    # fix a window in place: bad data symbols by XOR-ing out Sp, bad parity
+    # symbols by re-encoding just their columns
+    k = self.data_num
+    cols = np.flatnonzero((bad >= 0) & (bad < k))
+    content[bad[cols], cols] ^= syndrome[cols]
+    cols = np.flatnonzero(bad >= k)
+    if len(cols) > 0:
+      parity[:, cols] = self.gf.matmul(self.gf.vander, content[:, cols])
+
+  def __stripe_runs(self, mask, chunk_size):
+    # (start, end) column ranges of the consecutive stripes touched by mask
+    stripes = mask.reshape(-1, chunk_size).any(axis=1)
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], stripes.astype(np.int8), [0]])))
+    return [(start * chunk_size, end * chunk_size) for start, end in zip(edges[::2], edges[1::2])]
+
   def __distribute_data(self, input_file_path, file_meta):
-    with open(input_file_path, 'rb') as f:
-      s = list(f.read())
-      size = len(s)
-      file_meta['size'] = size
-      return self.__pad_and_reshape(s, size)
-  
-  def __distribute_real_data(self, data):
-    s = list(data)
-    return self.__pad_and_reshape(s, len(s))
+    size = os.path.getsize(input_file_path)
+    file_meta['size'] = size
+    s = self.__alloc_stripes(size, file_meta['chunk_size'])
+    with self.stats.Time('file_read', size), open(input_file_path, 'rb') as f:
+      f.readinto(memoryview(s)[:size])
+    return s.reshape(self.data_num, -1)
   
-  def __pad_and_reshape(self, s, size):
-    total_stripe = size // self.stripe_size
-    if size % self.stripe_size != 0:
+  def __chunk_size(self, key_meta):
+    # keys written before chunk sizes were recorded use the store's
+    return key_meta.get('chunk_size', self.chunk_size)
+
+  def __shard_size(self, size, chunk_size):
+    stripe_size = (self.data_num) * chunk_size
+    total_stripe = size // stripe_size
+    if size % stripe_size != 0:
       total_stripe += 1
-    total_stripe_size = total_stripe * self.stripe_size
-    s = s + [0] * (total_stripe_size - size) # padding
-    s = np.asarray(s, dtype=int)
-    s = s.reshape(self.node_num - 2, CHUNK_SIZE * total_stripe)
-    return s
+    return total_stripe * chunk_size
+
+  def __alloc_stripes(self, size, chunk_size):
+    # zero-filled buffer padded to a whole number of stripes
+    return np.zeros(self.__shard_size(size, chunk_size) * (self.data_num), dtype=np.uint8)
+
+  def __object_view(self, content, size):
+    return memoryview(content.reshape(-1))[:size]
   
+  def Stats(self):
+    # snapshot of the phase timings, counters and per-node call latencies
+    # (recorded if the store was opened with stats=True), with the read
+    # cache counters and the number of decode matrix inversions
+    snapshot = self.stats.Snapshot()
+    snapshot['cache'] = self.cache.Stats()
+    snapshot['counters']['decode_inversions'] = self.gf.inversions
+    return snapshot
+
   def Close(self):
-    with open(os.path.join(self.path, 'obj_meta.json'), 'w') as f:
-      # print(self.meta)
-      f.write(json.dumps(self.meta))
-    for i in range(self.node_num):
-      self.nodes[i].Close()
+    self.meta['keys'].Set('placement', self.placement.State())
+    self.meta['keys'].Close()
+    self.executor.shutdown()
+    if self.encode_pool is not None:
+      self.encode_pool.shutdown()
+    for node in self.nodes.values():
+      node.Close()
+
+  async def aclose(self):
+    await asyncio.gather(*[node.Close() for node in self.anodes.values()])
+    self.anodes = {}
+    self.Close()
   
+  def __shard_key(self, key):
+    # packed objects live in the shards of their pack
+    return self.meta['keys'][key].get('pack', key)
+
   def CrashParityNode(self, key, num=1):
     if key not in self.meta['keys']:
       return False
+    key = self.__shard_key(key)
     obj_meta = self.meta['keys'][key]
     assert(num <= 2)
     if num == 1:
@@ -271,8 +1044,9 @@ class ObjectStore:
   def CrashDataNode(self, key, num=1):
     if key not in self.meta['keys']:
       return False
+    key = self.__shard_key(key)
     obj_meta = self.meta['keys'][key]
-    assert(num <= self.node_num - 2)
+    assert(num <= self.data_num)
     data_nodes = obj_meta['data_nodes']
     node_ids = np.random.choice(data_nodes, size=num, replace=False)
     for node_id in node_ids:
@@ -282,6 +1056,7 @@ class ObjectStore:
   def CorruptDataNode(self, key):
     if key not in self.meta['keys']:
       return False
+    key = self.__shard_key(key)
     obj_meta = self.meta['keys'][key]
     data_nodes = obj_meta['data_nodes']
     node_id = data_nodes[0]
@@ -291,6 +1066,7 @@ class ObjectStore:
   def CorruptParityNode(self, key):
     if key not in self.meta['keys']:
       return False
+    key = self.__shard_key(key)
     obj_meta = self.meta['keys'][key]
     parity_nodes = obj_meta['parity_nodes']
     node_id = np.random.choice(parity_nodes, size=1)[0]
@@ -301,7 +1077,8 @@ class ObjectStore:
   def RecoverAll(self, key):
     if key not in self.meta['keys']:
       return False
-    
+    key = self.__shard_key(key)
+
     obj_meta = self.meta['keys'][key]
     data_nodes = obj_meta['data_nodes']
     parity_nodes = obj_meta['parity_nodes']
@@ -311,27 +1088,35 @@ class ObjectStore:
       self.nodes[node_id].Recover()
     return True
 
-  def __read_from_nodes(self, node_ids, key):
-    content = [[] for _ in range(len(node_ids))]
-    tasks = []
+  def __read_shards(self, node_ids, key, offset=0, length=None):
+    # read the shards of node_ids straight into a len(node_ids) x length matrix
+    if length is None:
+      key_meta = self.meta['keys'][key]
+      length = self.__shard_size(key_meta['size'], self.__chunk_size(key_meta))
+    content = np.empty((len(node_ids), length), dtype=np.uint8)
+    futures = []
     for i in range(len(node_ids)):
-      node_id = node_ids[i]
-      def task(i, node_id):
-        def func():
-          content[i] = self.nodes[node_id].Read(key)
-        return func
-      tasks.append(task(i, node_id))
-    run_tasks(tasks)
+      node = self.nodes[node_ids[i]]
+      futures.append(self.executor.submit(node_ids[i], node.ReadInto, key, memoryview(content[i]), offset))
+    with self.stats.Time('node_read', content.nbytes):
+      counts = wait_all(futures)
+    self.__check_reads(key, [(node_id, length) for node_id in node_ids], counts)
     return content
 
-  def __write_to_nodes(self, node_ids, key, contents):
-    tasks = []
+  def __check_reads(self, key, reads, counts):
+    # reads holds the (node id, expected bytes) of every ReadInto; fewer
+    # bytes mean a truncated shard, which must not pass for data
+    for (node_id, expected), count in zip(reads, counts):
+      if count != expected:
+        raise IOError(f"short read of {key} from node {node_id}: {count} of {expected} bytes")
+
+  def __write_to_nodes(self, node_ids, key, contents, append=False):
+    futures = []
     for i in range(len(node_ids)):
-      node_id = node_ids[i]
-      def task(node_id, content):
-        def func():
-          self.nodes[node_id].Write(key, content)
-        return func
-      tasks.append(task(node_id, contents[i]))
-    run_tasks(tasks)
+      node = self.nodes[node_ids[i]]
+      write = node.Append if append else node.Write
+      futures.append(self.executor.submit(node_ids[i], write, key, contents[i]))
+      self.placement.Record(node_ids[i], len(contents[i]))
+    with self.stats.Time('node_write', sum(len(content) for content in contents)):
+      wait_all(futures)
     return True 
\ No newline at end of file
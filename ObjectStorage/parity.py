@@ -1,7 +1,10 @@
 import numpy as np 
+import threading
+from collections import OrderedDict
+from itertools import combinations
 
 class GaloisField(object):
-    def __init__(self, num_data_disk, num_check_disk, w = 8, modulus = 0b100011101):
+    def __init__(self, num_data_disk, num_check_disk, w = 8, modulus = 0b100011101, decode_cache_size = 256):
         self.num_data_disk = num_data_disk
         self.num_check_disk = num_check_disk
         self.w = w
@@ -9,8 +12,17 @@ class GaloisField(object):
         self.x_to_w = 1 << w 
         self.gflog = np.zeros((self.x_to_w, ), dtype=int)
         self.gfilog = np.zeros((self.x_to_w, ), dtype=int)
+        self.dtype = np.uint8 if w <= 8 else np.uint16
         self.vander = np.zeros((self.num_check_disk, self.num_data_disk), dtype=int)
+        # erased shard set -> decode matrix, in LRU order
+        self.decode_cache = OrderedDict()
+        self.decode_cache_size = decode_cache_size
+        # decode matrices computed so far, cache misses included
+        self.inversions = 0
+        # guards decode_cache and inversions, decodes run on many threads
+        self.decode_lock = threading.Lock()
         self.setup_tables()
+        self.setup_mult_table()
         self.setup_vander()
     
     def setup_tables(self):
@@ -22,6 +34,16 @@ class GaloisField(object):
             if b & self.x_to_w:
                 b = b ^ self.modulus
     
+    def setup_mult_table(self):
+        # full x_to_w * x_to_w product table, so a whole row of symbols can be
+        # multiplied by a coefficient with a single gather
+        logs = self.gflog[:, None] + self.gflog[None, :]
+        logs %= self.x_to_w - 1
+        table = self.gfilog[logs]
+        table[0, :] = 0
+        table[:, 0] = 0
+        self.mult_table = table.astype(self.dtype)
+
     def setup_vander(self):
         for i in range(self.num_check_disk):
             for j in range(self.num_data_disk):
@@ -54,6 +76,15 @@ class GaloisField(object):
             diff_log += self.x_to_w - 1
         return self.gfilog[diff_log]
     
+    def div_rows(self, a, b):
+        # element-wise a / b over symbol arrays, 0 wherever a or b is 0
+        a = np.asarray(a)
+        b = np.asarray(b)
+        logs = (self.gflog[a] - self.gflog[b]) % (self.x_to_w - 1)
+        res = self.gfilog[logs].astype(self.dtype)
+        res[(a == 0) | (b == 0)] = 0
+        return res
+
     def power(self, a, n):
         n %= self.x_to_w - 1
         res = 1
@@ -69,12 +100,28 @@ class GaloisField(object):
             res = self.add(res, self.mult(a[i], b[i]))
         return res
 
-    def matmul(self, a, b):
-        res = np.zeros([a.shape[0], b.shape[1]], dtype=int)
-        for i in range(res.shape[0]):
-            for j in range(res.shape[1]):
-                res[i][j] = self.dot(a[i, :], b[:, j])
-        return res
+    def mult_row(self, coef, row):
+        if coef == 0:
+            return np.zeros(row.shape, dtype=self.dtype)
+        if coef == 1:
+            return row
+        return self.mult_table[coef][row]
+
+    def matmul(self, a, b, out=None):
+        # a is a small coefficient matrix, b a (k x N) block of symbols: every
+        # output row is the XOR of table-multiplied input rows. The numpy
+        # kernels release the GIL, so column blocks can run in threads
+        a = np.asarray(a)
+        b = np.asarray(b).astype(self.dtype, copy=False)
+        if out is None:
+            out = np.empty([a.shape[0], b.shape[1]], dtype=self.dtype)
+        out[...] = 0
+        for i in range(a.shape[0]):
+            for j in range(a.shape[1]):
+                if a[i, j] == 0:
+                    continue
+                np.bitwise_xor(out[i], self.mult_row(a[i, j], b[j]), out=out[i])
+        return out
 
     def inverse(self, A):
         if A.shape[0] != A.shape[1]:
@@ -101,4 +148,29 @@ class GaloisField(object):
         if A.shape[0] != A.shape[1]:
             A_inverse = self.matmul(A_inverse, A_T)
 
-        return A_inverse
\ No newline at end of file
+        return A_inverse
+
+    def decode_matrix(self, erased):
+        # maps the surviving shards (data shards then check shards, erased
+        # ones removed) back to the data shards; only the first
+        # num_data_disk survivors are used, the other columns are zero
+        erased = tuple(sorted(erased))
+        with self.decode_lock:
+            if erased in self.decode_cache:
+                self.decode_cache.move_to_end(erased)
+                return self.decode_cache[erased]
+            self.inversions += 1
+            A = np.concatenate([np.eye(self.num_data_disk, dtype=int), self.vander], axis=0)
+            survivors = [i for i in range(A.shape[0]) if i not in erased]
+            D = np.zeros((self.num_data_disk, len(survivors)), dtype=int)
+            D[:, :self.num_data_disk] = self.inverse(A[survivors[:self.num_data_disk], :])
+            self.decode_cache[erased] = D
+            if len(self.decode_cache) > self.decode_cache_size:
+                self.decode_cache.popitem(last=False)
+            return D
+
+    def precompute_decode_matrices(self):
+        disks = range(self.num_data_disk + self.num_check_disk)
+        for n in range(self.num_check_disk + 1):
+            for erased in combinations(disks, n):
+                self.decode_matrix(erased)
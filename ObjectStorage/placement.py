@@ -0,0 +1,110 @@
+import hashlib
+import math
+import threading
+
+# placement groups per store; keys hash to a group, groups map to nodes
+PG_NUM = 256
+# Reweight keeps every weight within this factor of the node's capacity
+MAX_REWEIGHT = 2.0
+
+
+def stable_hash(*parts):
+  # 64-bit hash that is the same in every process, unlike the salted hash()
+  digest = hashlib.blake2b('/'.join(str(part) for part in parts).encode('utf-8'), digest_size=8).digest()
+  return int.from_bytes(digest, 'big')
+
+
+class Placement:
+  # deterministic key -> stripe mapping over a node pool that may be wider
+  # than the stripe. A key hashes to one of pg_num placement groups, and
+  # every group picks its `width` nodes by weighted rendezvous hashing, so
+  # each node gets a share of groups proportional to its weight and a new
+  # node only takes over the groups it wins. The parity positions rotate
+  # with the group number. Weights start at the node capacities; Reweight
+  # lowers the weight of nodes holding more than their share of bytes so
+  # new groups favour the emptier ones. Placement depends only on the key
+  # and this state, never on key metadata.
+  def __init__(self, width, capacities, pg_num=PG_NUM, weights=None, loads=None):
+    if width > len(capacities):
+      raise ValueError(f"stripe width {width} is wider than the {len(capacities)} node pool")
+    self.width = width
+    self.pg_num = pg_num
+    self.capacities = list(capacities)
+    self.weights = list(weights or capacities)
+    # bytes written to every node
+    self.loads = list(loads or [0] * len(capacities))
+    self.lock = threading.Lock()
+    # placement group -> node ids, data nodes first
+    self.groups = {}
+
+  def PlacementGroup(self, key):
+    return stable_hash(key) % self.pg_num
+
+  def Place(self, key):
+    # (data node ids, parity node ids) of key's stripe
+    nodes = self.Group(self.PlacementGroup(key))
+    return nodes[:-2], nodes[-2:]
+
+  def Group(self, pg):
+    with self.lock:
+      if pg not in self.groups:
+        self.groups[pg] = self.__map_group(pg)
+      return self.groups[pg]
+
+  def Record(self, node_id, nbytes):
+    with self.lock:
+      self.loads[node_id] += nbytes
+
+  def AddNode(self, capacity=1.0):
+    with self.lock:
+      self.capacities.append(capacity)
+      self.weights.append(capacity)
+      self.loads.append(0)
+      self.groups = {}
+      return len(self.capacities) - 1
+
+  def Reweight(self):
+    # scale every weight by how far the node's share of the stored bytes is
+    # below or above its share of the capacity
+    with self.lock:
+      total_load = sum(self.loads)
+      total_capacity = sum(self.capacities)
+      if total_load == 0:
+        return
+      for i, capacity in enumerate(self.capacities):
+        share = self.loads[i] / total_load
+        target = capacity / total_capacity
+        factor = MAX_REWEIGHT if share == 0 else min(max(target / share, 1 / MAX_REWEIGHT), MAX_REWEIGHT)
+        self.weights[i] = capacity * factor
+      self.groups = {}
+
+  def State(self):
+    with self.lock:
+      return {
+        'width': self.width,
+        'pg_num': self.pg_num,
+        'capacities': list(self.capacities),
+        'weights': list(self.weights),
+        'loads': list(self.loads),
+      }
+
+  @classmethod
+  def FromState(cls, state):
+    return cls(state['width'], state['capacities'], state['pg_num'], state['weights'], state['loads'])
+
+  def __map_group(self, pg):
+    # the width nodes with the highest weight / -ln(u) scores, u uniform in
+    # (0, 1) from the hash of (group, node); zero weight nodes are never used
+    scores = []
+    for node_id, weight in enumerate(self.weights):
+      if weight <= 0:
+        continue
+      u = (stable_hash(pg, node_id) + 1) / (2 ** 64 + 1)
+      scores.append((weight / -math.log(u), node_id))
+    if len(scores) < self.width:
+      raise ValueError(f"only {len(scores)} nodes can take stripes of width {self.width}")
+    nodes = [node_id for _, node_id in sorted(scores, reverse=True)[:self.width]]
+    nodes.sort()
+    # rotate so that parity lands on a different position in every group
+    shift = pg % self.width
+    return nodes[shift:] + nodes[:shift]
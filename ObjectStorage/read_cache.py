@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+
+# invalidations remembered per key; older ones only move the horizon
+INVALIDATIONS = 4096
+
+
+class ReadCache:
+  # decoded windows of recently read objects, keyed by (key, shard offset,
+  # length) and evicted least recently used first once they take more than
+  # max_bytes; max_bytes=0 disables the cache. Cached arrays are read-only
+  # and shared by every reader. A window loaded while its key was
+  # invalidated may hold the old content, so loads take a Generation first
+  # and Put drops the window if the key was invalidated since.
+  def __init__(self, max_bytes=0):
+    self.max_bytes = max_bytes
+    self.lock = threading.Lock()
+    self.entries = OrderedDict()
+    # object key -> its cached (key, offset, length) entries
+    self.by_key = {}
+    self.bytes = 0
+    # invalidation clock, the clock of each key's last invalidation, and
+    # the newest clock forgotten from invalidated
+    self.clock = 0
+    self.invalidated = OrderedDict()
+    self.horizon = 0
+    self.hits = 0
+    self.misses = 0
+    self.evictions = 0
+
+  def Get(self, key, offset, length):
+    if self.max_bytes == 0:
+      return None
+    with self.lock:
+      content = self.entries.get((key, offset, length))
+      if content is None:
+        self.misses += 1
+        return None
+      self.entries.move_to_end((key, offset, length))
+      self.hits += 1
+      return content
+
+  def Generation(self):
+    with self.lock:
+      return self.clock
+
+  def Put(self, key, offset, length, content, generation):
+    if self.max_bytes == 0 or content.nbytes > self.max_bytes:
+      return
+    content.setflags(write=False)
+    with self.lock:
+      if generation < max(self.horizon, self.invalidated.get(key, 0)):
+        return
+      entry = (key, offset, length)
+      if entry in self.entries:
+        self.__remove(entry)
+      self.entries[entry] = content
+      self.by_key.setdefault(key, set()).add(entry)
+      self.bytes += content.nbytes
+      while self.bytes > self.max_bytes:
+        self.__remove(next(iter(self.entries)))
+        self.evictions += 1
+
+  def Invalidate(self, key):
+    with self.lock:
+      for entry in list(self.by_key.get(key, ())):
+        self.__remove(entry)
+      self.clock += 1
+      self.invalidated[key] = self.clock
+      self.invalidated.move_to_end(key)
+      if len(self.invalidated) > INVALIDATIONS:
+        _, self.horizon = self.invalidated.popitem(last=False)
+
+  def Clear(self):
+    with self.lock:
+      self.entries = OrderedDict()
+      self.by_key = {}
+      self.bytes = 0
+
+  def Stats(self):
+    with self.lock:
+      return {
+        'hits': self.hits,
+        'misses': self.misses,
+        'evictions': self.evictions,
+        'bytes': self.bytes,
+        'entries': len(self.entries),
+      }
+
+  def __remove(self, entry):
+    content = self.entries.pop(entry)
+    self.bytes -= content.nbytes
+    entries = self.by_key[entry[0]]
+    entries.discard(entry)
+    if len(entries) == 0:
+      del self.by_key[entry[0]]
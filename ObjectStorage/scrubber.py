@@ -0,0 +1,104 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Scrubber:
+  # walks every key of an ObjectStore in the background, checking each
+  # window against its P/Q parity and repairing correctable corruption, so
+  # latent errors are found before a read needs them. Shard reads are held
+  # to bytes_per_sec (None for no limit) and at most `workers` keys are
+  # scrubbed at once. The cursor and counters live in the store's metadata
+  # index, so a stopped scrub resumes from the last finished key. Stop the
+  # scrubber before closing the store.
+  def __init__(self, store, bytes_per_sec=None, workers=1, pause=60.0):
+    self.store = store
+    self.index = store.meta['keys']
+    self.bytes_per_sec = bytes_per_sec
+    self.workers = workers
+    # seconds to wait between two full passes
+    self.pause = pause
+    self.lock = threading.Lock()
+    self.stopped = threading.Event()
+    self.thread = None
+    self.budget_start = time.monotonic()
+    self.budget_used = 0
+    self.metrics = self.index.Get('scrub_metrics', {
+      'keys': 0,
+      'bytes': 0,
+      'repaired': 0,
+      'uncorrectable': 0,
+      'skipped': 0,
+      'passes': 0,
+      'last_pass': None,
+    })
+
+  def Start(self):
+    if self.thread is None:
+      self.thread = threading.Thread(target=self.__run, daemon=True)
+      self.thread.start()
+
+  def Stop(self):
+    if self.thread is not None:
+      self.stopped.set()
+      self.thread.join()
+      self.thread = None
+      self.stopped.clear()
+
+  def Metrics(self):
+    with self.lock:
+      return dict(self.metrics, cursor=self.index.Get('scrub_cursor'))
+
+  def RunOnce(self, max_keys=None):
+    # scrub from the cursor until the last key, max_keys keys or Stop;
+    # returns True if a full pass was completed
+    self.budget_start = time.monotonic()
+    self.budget_used = 0
+    scrubbed = 0
+    keys = self.index.Scan(self.index.Get('scrub_cursor'))
+    with ThreadPoolExecutor(self.workers) as pool:
+      while not self.stopped.is_set():
+        batch_size = self.workers if max_keys is None else min(self.workers, max_keys - scrubbed)
+        batch = [key for _, key in zip(range(batch_size), keys)]
+        if len(batch) == 0:
+          break
+        results = list(pool.map(self.__scrub, batch))
+        scrubbed += len(batch)
+        with self.lock:
+          for status, scanned in results:
+            self.metrics['keys'] += 1
+            self.metrics['bytes'] += scanned
+            if status != 'clean':
+              self.metrics[status] += 1
+          self.__save(batch[-1])
+        if max_keys is not None and scrubbed >= max_keys:
+          return False
+    if self.stopped.is_set():
+      return False
+    with self.lock:
+      self.metrics['passes'] += 1
+      self.metrics['last_pass'] = time.time()
+      self.__save(None)
+    return True
+
+  def __run(self):
+    while not self.stopped.is_set():
+      if self.RunOnce():
+        self.stopped.wait(self.pause)
+
+  def __scrub(self, key):
+    return self.store.ScrubKey(key, self.__throttle)
+
+  def __throttle(self, nbytes):
+    # sleep until the bytes read so far fit in the budget
+    if self.bytes_per_sec is None:
+      return
+    with self.lock:
+      self.budget_used += nbytes
+      delay = self.budget_used / self.bytes_per_sec - (time.monotonic() - self.budget_start)
+    if delay > 0:
+      self.stopped.wait(delay)
+
+  def __save(self, cursor):
+    self.index.Set('scrub_cursor', cursor)
+    self.index.Set('scrub_metrics', self.metrics)
@@ -0,0 +1,91 @@
+import contextlib
+import threading
+import time
+
+# node call latency histograms have one bucket per power of two microseconds
+HISTOGRAM_BUCKETS = 32
+
+NO_TIMER = contextlib.nullcontext()
+
+
+class StatsRecorder:
+  # phase timings, counters and per-node call latencies of an ObjectStore.
+  # A disabled recorder hands out one shared no-op timer and ignores every
+  # record, so the hooks cost a method call. Each record is also passed to
+  # sink(event) if one is given.
+  def __init__(self, enabled=False, sink=None):
+    self.enabled = enabled
+    self.sink = sink
+    self.lock = threading.Lock()
+    self.Reset()
+
+  def Reset(self):
+    with self.lock:
+      self.phases = {}
+      self.counters = {}
+      self.nodes = {}
+
+  def Time(self, phase, nbytes=0):
+    # context manager timing one run of phase over nbytes bytes
+    if not self.enabled:
+      return NO_TIMER
+    return PhaseTimer(self, phase, nbytes)
+
+  def Add(self, counter, n=1):
+    if not self.enabled:
+      return
+    with self.lock:
+      self.counters[counter] = self.counters.get(counter, 0) + n
+    if self.sink is not None:
+      self.sink({'type': 'counter', 'name': counter, 'value': n})
+
+  def Phase(self, phase, seconds, nbytes=0):
+    with self.lock:
+      entry = self.phases.setdefault(phase, {'count': 0, 'seconds': 0.0, 'bytes': 0})
+      entry['count'] += 1
+      entry['seconds'] += seconds
+      entry['bytes'] += nbytes
+    if self.sink is not None:
+      self.sink({'type': 'phase', 'name': phase, 'seconds': seconds, 'bytes': nbytes})
+
+  def NodeCall(self, node_id, op, seconds):
+    bucket = min(int(seconds * 1e6).bit_length(), HISTOGRAM_BUCKETS - 1)
+    with self.lock:
+      entry = self.nodes.setdefault(node_id, {}).setdefault(op, {'count': 0, 'seconds': 0.0, 'histogram': [0] * HISTOGRAM_BUCKETS})
+      entry['count'] += 1
+      entry['seconds'] += seconds
+      entry['histogram'][bucket] += 1
+    if self.sink is not None:
+      self.sink({'type': 'node', 'node': node_id, 'name': op, 'seconds': seconds})
+
+  def Snapshot(self):
+    # copies of the recorded values; node histograms map the upper bound of
+    # every non-empty bucket in microseconds to its call count
+    with self.lock:
+      nodes = {}
+      for node_id, ops in self.nodes.items():
+        nodes[node_id] = {op: {
+          'count': entry['count'],
+          'seconds': entry['seconds'],
+          'histogram_us': {1 << i: n for i, n in enumerate(entry['histogram']) if n > 0},
+        } for op, entry in ops.items()}
+      return {
+        'phases': {phase: dict(entry) for phase, entry in self.phases.items()},
+        'counters': dict(self.counters),
+        'nodes': nodes,
+      }
+
+
+class PhaseTimer:
+  def __init__(self, recorder, phase, nbytes):
+    self.recorder = recorder
+    self.phase = phase
+    self.nbytes = nbytes
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, *exc):
+    self.recorder.Phase(self.phase, time.perf_counter() - self.start, self.nbytes)
+    return False
@@ -1,81 +1,130 @@
-import timeit
-import os
+import argparse
+import csv
+import itertools
+import json
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
 from ObjectStorage import ObjectStore
 
+# failure mode -> how to damage a freshly written key before it is read
+FAILURES = {
+  'healthy': lambda store, key: None,
+  'crash1': lambda store, key: store.CrashDataNode(key, 1),
+  'crash2': lambda store, key: store.CrashDataNode(key, 2),
+  'corrupt_data': lambda store, key: store.CorruptDataNode(key),
+  'corrupt_parity': lambda store, key: store.CorruptParityNode(key),
+}
 
+FIELDS = ['size', 'node_num', 'chunk_size', 'backend', 'failure', 'phase', 'runs', 'mb_s', 'p50_ms', 'p99_ms']
 
-def test_func(test, test_time=10):  
-  os.system("rm -rf /tmp/raid6/*")
-  store = ObjectStore("/tmp/raid6", 5)
-  t = timeit.Timer(test(store))
-  print('write and read (5): ', t.timeit(test_time))
-  
-  os.system("rm -rf /tmp/raid6/*")
-  store = ObjectStore("/tmp/raid6", 7)
-  t = timeit.Timer(test(store))
-  print('write and read (7): ', t.timeit(test_time))
-  
-  os.system("rm -rf /tmp/raid6/*")
-  store = ObjectStore("/tmp/raid6", 9)
-  t = timeit.Timer(test(store))
-  print('write and read (9): ', t.timeit(test_time))
-  
-  os.system("rm -rf /tmp/raid6/*")
-  store = ObjectStore("/tmp/raid6", 11)
-  t = timeit.Timer(test(store))
-  print('write and read (11): ', t.timeit(test_time))
-
-def test_normal_read_write(store):
-  input_file = "example/test.log"
-  output_file = "output.txt"
-  def ret():
-    ret = store.WriteToStore(input_file, "test_normal")
-    assert(ret)
-    ret = store.ReadFromStore("test_normal", output_file)
-    assert(ret)
-  return ret
-
-def test_normal_read_write2(store):
-  input_file = "example/Tank.fbx"
-  output_file = "output.txt"
-  def ret():
-    ret = store.WriteToStore(input_file, "test_normal")
-    assert(ret)
-    ret = store.ReadFromStore("test_normal", output_file)
-    assert(ret)
-  return ret
-
-def test_crash_read_write(pstore):
-  input_file = "example/test.log"
-  output_file = "output.txt"
-  def ret():
-    os.system("rm -rf /tmp/raid6/*")
-    store = ObjectStore("/tmp/raid6", pstore.node_num)
-    ret = store.WriteToStore(input_file, "test_crash")
-    assert(ret)
-    store.CrashDataNode("test_crash", 1)
-    ret = store.ReadFromStore("test_crash", output_file)
-    assert(ret)
-  return ret
-
-def test_crash_read_write2(pstore):
-  input_file = "example/Tank.fbx"
-  output_file = "output.txt"
-  def ret():
-    os.system("rm -rf /tmp/raid6/*")
-    store = ObjectStore("/tmp/raid6", pstore.node_num)
-    ret = store.WriteToStore(input_file, "test_crash")
-    assert(ret)
-    store.CrashDataNode("test_crash", 1)
-    ret = store.ReadFromStore("test_crash", output_file)
-    assert(ret)
-  return ret
-
-print('normal read write')
-test_func(test_normal_read_write, 100)
-print('data rebuild')
-test_func(test_crash_read_write, 20)
-print('large data read and write')
-test_func(test_normal_read_write2, 3)
-print('large file data rebuild')
-test_func(test_crash_read_write2, 3)
\ No newline at end of file
+
+def parse_sizes(text):
+  # "4K,1M,64M" -> [4096, 1048576, 67108864]
+  units = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+  sizes = []
+  for item in text.split(','):
+    item = item.strip().upper()
+    if item[-1] in units:
+      sizes.append(int(float(item[:-1]) * units[item[-1]]))
+    else:
+      sizes.append(int(item))
+  return sizes
+
+
+def parse_ints(text):
+  return [int(item) for item in text.split(',')]
+
+
+def summarize(config, phase, size, latencies):
+  latencies = np.array(latencies)
+  return dict(config,
+    phase=phase,
+    runs=len(latencies),
+    mb_s=round(size * len(latencies) / latencies.sum() / 1e6, 2),
+    p50_ms=round(float(np.percentile(latencies, 50)) * 1e3, 3),
+    p99_ms=round(float(np.percentile(latencies, 99)) * 1e3, 3))
+
+
+def run_config(root, data, node_num, chunk_size, backend, failure, repeat):
+  # one store per configuration; creating and removing it is not timed
+  path = tempfile.mkdtemp(prefix='bench_', dir=root)
+  store = ObjectStore(path, node_num, node_type=backend, chunk_size=chunk_size)
+  latencies = {'encode': [], 'write': [], 'read': []}
+  try:
+    matrix = np.frombuffer(data, dtype=np.uint8)
+    stripe = (node_num - 2) * chunk_size
+    padded = np.zeros(-(-len(data) // stripe) * stripe, dtype=np.uint8)
+    padded[:len(data)] = matrix
+    padded = padded.reshape(node_num - 2, -1)
+    for i in range(repeat):
+      key = f"bench_{i}"
+      start = time.perf_counter()
+      store.gf.matmul(store.gf.vander, padded)
+      latencies['encode'].append(time.perf_counter() - start)
+
+      start = time.perf_counter()
+      assert store.put(key, data)
+      latencies['write'].append(time.perf_counter() - start)
+
+      FAILURES[failure](store, key)
+      start = time.perf_counter()
+      content = store.get(key)
+      latencies['read'].append(time.perf_counter() - start)
+      assert content == data, f"{failure} read of {key} returned wrong data"
+      store.RecoverAll(key)
+  finally:
+    store.Close()
+    shutil.rmtree(path, ignore_errors=True)
+  return latencies
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='ObjectStore throughput and latency matrix')
+  parser.add_argument('--sizes', type=parse_sizes, default=parse_sizes('4K,1M,16M'), help='object sizes, e.g. 4K,1M,16M')
+  parser.add_argument('--nodes', type=parse_ints, default=[5, 7, 9, 11], help='node counts')
+  parser.add_argument('--chunk-sizes', type=parse_ints, default=[16, 4096, 65536], help='chunk sizes in bytes')
+  parser.add_argument('--backends', default='simple', help='node backends: simple,remote,mmap')
+  parser.add_argument('--failures', default=','.join(FAILURES), help='failure modes: ' + ','.join(FAILURES))
+  parser.add_argument('--repeat', type=int, default=10, help='runs per configuration')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--root', default=tempfile.gettempdir(), help='directory for the temporary stores')
+  parser.add_argument('--json', help='write the results to this JSON file')
+  parser.add_argument('--csv', help='write the results to this CSV file')
+  args = parser.parse_args(argv)
+
+  rng = np.random.default_rng(args.seed)
+  results = []
+  writer = csv.DictWriter(sys.stdout, FIELDS, delimiter='\t')
+  writer.writeheader()
+  for size in args.sizes:
+    data = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+    for node_num, chunk_size, backend, failure in itertools.product(args.nodes, args.chunk_sizes, args.backends.split(','), args.failures.split(',')):
+      config = {
+        'size': size,
+        'node_num': node_num,
+        'chunk_size': chunk_size,
+        'backend': backend,
+        'failure': failure,
+      }
+      latencies = run_config(args.root, data, node_num, chunk_size, backend, failure, args.repeat)
+      for phase in latencies:
+        results.append(summarize(config, phase, size, latencies[phase]))
+        writer.writerow(results[-1])
+
+  if args.json:
+    with open(args.json, 'w') as f:
+      commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True).stdout.strip()
+      json.dump({'commit': commit, 'results': results}, f, indent=2)
+  if args.csv:
+    with open(args.csv, 'w', newline='') as f:
+      writer = csv.DictWriter(f, FIELDS)
+      writer.writeheader()
+      writer.writerows(results)
+
+
+if __name__ == '__main__':
+  main()